@@ -1,6 +1,9 @@
 from fastapi.security import OAuth2AuthorizationCodeBearer
 from keycloak import KeycloakOpenID 
+from jose import jwt
 from auth.config import settings
+from auth.keys import SigningKeyCache, VerifiedTokenCache
+from internal.admin import AUTH_KEY_TTL, AUTH_KEY_MIN_REFRESH, AUTH_TOKEN_CACHE_SIZE
 from fastapi import Security, HTTPException, status,Depends
 from pydantic import Json
 from routers.schemas import UserProfile
@@ -21,19 +24,19 @@ keycloak_openid = KeycloakOpenID(
     verify=True
 )
 
-async def get_idp_public_key():
-    return (
-        "-----BEGIN PUBLIC KEY-----\n"
-        f"{keycloak_openid.public_key()}"
-        "\n-----END PUBLIC KEY-----"
-    )
+signing_keys = SigningKeyCache(keycloak_openid.certs, ttl=AUTH_KEY_TTL, min_refresh=AUTH_KEY_MIN_REFRESH)
+verified_tokens = VerifiedTokenCache(AUTH_TOKEN_CACHE_SIZE)
 
 # Get the payload/token from keycloak
 async def get_payload(token: str = Security(oauth2_scheme)) -> dict:
+    payload = verified_tokens.get(token)
+    if payload is not None:
+        return payload
     try:
-        return keycloak_openid.decode_token(
+        key = await signing_keys.get(jwt.get_unverified_header(token).get("kid"))
+        payload = keycloak_openid.decode_token(
             token,
-            key= await get_idp_public_key(),
+            key=key,
             options={
                 "verify_signature": True,
                 "verify_aud": False,
@@ -46,6 +49,8 @@ async def get_payload(token: str = Security(oauth2_scheme)) -> dict:
             detail=str(e), # "Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    verified_tokens.put(token, payload)
+    return payload
         
 # Get user infos from the payload
 async def get_user_info(payload: dict = Depends(get_payload)):
@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+
+class SigningKeyCache:
+    """Signing keys of the realm, fetched from its JWKS endpoint.
+
+    Keys are cached for ttl seconds. A token signed with an unknown kid
+    triggers a refetch, at most once every min_refresh seconds, so key
+    rotation is picked up without letting bogus tokens hammer the IdP.
+    """
+
+    def __init__(self, fetch_jwks: Callable[[], dict], ttl: float, min_refresh: float):
+        self.fetch_jwks = fetch_jwks
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self._keys: Dict[Optional[str], dict] = {}
+        self._fetched_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+
+    def _age(self) -> float:
+        return float("inf") if self._fetched_at is None else time.monotonic() - self._fetched_at
+
+    def _lookup(self, kid: Optional[str]) -> Optional[dict]:
+        if kid is None and len(self._keys) == 1:
+            return next(iter(self._keys.values()))
+        return self._keys.get(kid)
+
+    async def get(self, kid: Optional[str]) -> dict:
+        key = self._lookup(kid)
+        if key is not None and self._age() < self.ttl:
+            self.hits += 1
+            return key
+
+        self.misses += 1
+        async with self._lock:
+            # Another request may have refreshed the keys while we waited
+            key = self._lookup(kid)
+            if key is None or self._age() >= self.ttl:
+                if self._age() >= self.min_refresh:
+                    try:
+                        await self._refresh()
+                    except Exception:
+                        # Keep serving a known key while the IdP is unreachable
+                        if key is None:
+                            raise
+                key = self._lookup(kid) or key
+        if key is None:
+            raise KeyError(f"Unknown signing key {kid}")
+        return key
+
+    async def _refresh(self):
+        jwks = await asyncio.to_thread(self.fetch_jwks)
+        self.fetches += 1
+        self._keys = {key.get("kid"): key for key in jwks.get("keys", []) if key.get("use", "sig") == "sig"}
+        self._fetched_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {"keys": len(self._keys), "hits": self.hits, "misses": self.misses, "fetches": self.fetches}
+
+
+class VerifiedTokenCache:
+    """LRU of already verified token payloads, keyed by the token's hash.
+
+    An entry is only served until the token's exp, after which the token
+    has to be verified (and rejected) again.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        payload, expires = entry
+        if expires is not None and expires <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def put(self, token: str, payload: dict):
+        key = self._key(token)
+        self._entries[key] = (payload, payload.get("exp"))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
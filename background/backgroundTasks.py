@@ -1,27 +1,42 @@
-from fastapi import FastAPI, BackgroundTasks, APIRouter
-from sqlalchemy.orm import Session
-from database.models import DbApplication
-from routers.application import monitor_endpoints, time_to_seconds
+import asyncio
+from database.database import async_session_scope, async_engine
+from background.probe import probe_engine
+from background.scheduler import scheduler, schedule_applications
+from background.compaction import compaction_loop
+from background.ipinfo import ip_refresh_loop
+from background.writer import probe_writer
+from background.shards import shard_manager, shard_loop, relay_loop
+from routers.application import monitor_endpoints
 
-router = APIRouter(
-    prefix="",  
-    tags=["Background"]
-)
-# Start tasks on startup
-@router.on_event("startup")
-async def startup_event(background_tasks: BackgroundTasks, db: Session = None):
-    if db is None:
-        raise ValueError("Database session is not provided")
+tasks = []
 
-    async def startup_task():
-        applications = db.query(DbApplication).all()
-        for app in applications:
-            background_tasks.add_task(
-                monitor_endpoints,
-                app_id=app.uid,
-                refresh_interval=time_to_seconds(app.refreshInterval),
-                time_to_keep=time_to_seconds(app.timeToKeep),
-                db=db
-            )
 
-    background_tasks.add_task(startup_task)
+# Start monitoring every stored application, called from the app lifespan
+async def startup_event():
+    if shard_manager.enabled:
+        # Only probe the applications of the shards leased by this worker
+        scheduler.accepts = shard_manager.owns
+        await shard_manager.rebalance()
+        tasks.append(asyncio.create_task(shard_loop()))
+        tasks.append(asyncio.create_task(relay_loop()))
+    async with async_session_scope() as db:
+        await schedule_applications(db)
+    probe_writer.start()
+    scheduler.start(monitor_endpoints)
+    tasks.append(asyncio.create_task(compaction_loop()))
+    tasks.append(asyncio.create_task(ip_refresh_loop()))
+
+
+# Stop the scheduler and the background jobs, drain the writer and
+# release the probe client and the shard leases
+async def shutdown_event():
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    tasks.clear()
+    await scheduler.stop()
+    await probe_writer.stop()
+    if shard_manager.enabled:
+        await shard_manager.release()
+    await probe_engine.close()
+    await async_engine.dispose()
@@ -0,0 +1,203 @@
+import asyncio
+import json
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from database.database import session_scope
+from database.models import DbApplication, DbEndpoint, DbEndpointLog, DbEndpointLogMinute, DbEndpointLogHour, DbOutage
+from internal.admin import RAW_LOG_RETENTION, MINUTE_ROLLUP_RETENTION, COMPACTION_INTERVAL, COMPACTION_BATCH_SIZE, LOG_SLICE
+from internal.metrics import errors
+from background.shards import shard_manager
+from routers.utils import OK_STATUSES, STATUS_WINDOW, HISTOGRAM_BOUNDS, latency_bin, time_to_seconds, latest_logs_query
+
+# Newest raw logs kept per endpoint whatever their age, so slowly probed
+# endpoints still have a latest slice and a stability window to seed from
+RAW_LOG_KEEP = max(LOG_SLICE, STATUS_WINDOW)
+
+
+class Rollup:
+    """Mergeable aggregate of the probes of one endpoint in one bucket.
+
+    The status histogram covers every probe. Failed probes are stored with
+    a response time of 0, so only successful ones count toward the min,
+    max, mean and latency histogram. Rows rolled up before the latency
+    histogram was kept have none, their probes are missing from it.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.statuses = Counter()
+        self.min = None
+        self.max = None
+        self.mean = None
+        self.timed = 0
+        self.latencies = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def add(self, status: str, response_time: float):
+        if status in OK_STATUSES:
+            self.merge(1, {status: 1}, response_time, response_time, response_time)
+            self.latencies[latency_bin(response_time)] += 1
+        else:
+            self.merge(1, {status: 1}, None, None, None)
+
+    def merge(self, count: int, statuses: Dict[str, int], minimum: float, maximum: float, mean: float, latencies: Optional[List[int]] = None):
+        if not count:
+            return
+        self.count += count
+        self.statuses.update(statuses)
+        if latencies:
+            self.latencies = [total + added for total, added in zip(self.latencies, latencies)]
+        timed = sum(statuses.get(status, 0) for status in OK_STATUSES)
+        if timed and mean is not None:
+            total = self.timed + timed
+            self.mean = ((self.mean or 0.0) * self.timed + mean * timed) / total
+            self.timed = total
+        if minimum is not None:
+            self.min = minimum if self.min is None else min(self.min, minimum)
+        if maximum is not None:
+            self.max = maximum if self.max is None else max(self.max, maximum)
+
+    def merge_row(self, row):
+        self.merge(row.count, json.loads(row.statuses or "{}"), row.minResponseTime, row.maxResponseTime, row.meanResponseTime, json.loads(row.latencies or "null"))
+
+    def write(self, row):
+        row.count = self.count
+        row.statuses = json.dumps(dict(self.statuses))
+        row.latencies = json.dumps(self.latencies)
+        row.minResponseTime = self.min
+        row.maxResponseTime = self.max
+        row.meanResponseTime = self.mean
+
+
+def minute_bucket(timestamp: datetime) -> datetime:
+    return timestamp.replace(second=0, microsecond=0)
+
+
+def hour_bucket(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _store_rollups(db: Session, model, rollups: Dict[Tuple[int, datetime], Rollup]):
+    # Merge into rows that already exist for these buckets, insert the rest
+    endpoint_ids = {endpoint_id for endpoint_id, _ in rollups}
+    buckets = {bucket for _, bucket in rollups}
+    existing = {
+        (row.endpointId, row.bucket): row
+        for row in db.query(model).filter(model.endpointId.in_(endpoint_ids), model.bucket.in_(buckets))
+    }
+    for (endpoint_id, bucket), rollup in rollups.items():
+        row = existing.get((endpoint_id, bucket))
+        if row is None:
+            row = model(endpointId=endpoint_id, bucket=bucket)
+            db.add(row)
+        else:
+            rollup.merge_row(row)
+        rollup.write(row)
+
+
+def _kept_raw_logs(db: Session, endpoint_ids: List[int], cutoff: datetime) -> Set[int]:
+    """Uids of the logs older than cutoff that are among the newest RAW_LOG_KEEP of their endpoint."""
+    query = latest_logs_query(endpoint_ids, RAW_LOG_KEEP).where(DbEndpointLog.timestamp < cutoff)
+    return set(db.execute(query.with_only_columns(DbEndpointLog.uid)).scalars())
+
+
+def _roll_raw_logs(db: Session, endpoint_ids: List[int], cutoff: datetime) -> int:
+    kept = _kept_raw_logs(db, endpoint_ids, cutoff)
+    rolled = 0
+    last_uid = 0
+    while True:
+        rows = db.query(
+            DbEndpointLog.uid, DbEndpointLog.endpointId, DbEndpointLog.timestamp, DbEndpointLog.status, DbEndpointLog.responseTime
+        ).filter(
+            DbEndpointLog.endpointId.in_(endpoint_ids),
+            DbEndpointLog.timestamp < cutoff,
+            DbEndpointLog.uid > last_uid
+        ).order_by(DbEndpointLog.uid).limit(COMPACTION_BATCH_SIZE).all()
+        if not rows:
+            return rolled
+        last_uid = rows[-1].uid
+        rows = [row for row in rows if row.uid not in kept]
+        if not rows:
+            continue
+
+        rollups = defaultdict(Rollup)
+        for uid, endpoint_id, timestamp, status, response_time in rows:
+            rollups[(endpoint_id, minute_bucket(timestamp))].add(status, response_time or 0.0)
+        _store_rollups(db, DbEndpointLogMinute, rollups)
+        db.query(DbEndpointLog).filter(DbEndpointLog.uid.in_([row.uid for row in rows])).delete(synchronize_session=False)
+        db.commit()
+        rolled += len(rows)
+
+
+def _roll_minute_rollups(db: Session, endpoint_ids: List[int], cutoff: datetime) -> int:
+    rolled = 0
+    while True:
+        rows = db.query(DbEndpointLogMinute).filter(
+            DbEndpointLogMinute.endpointId.in_(endpoint_ids),
+            DbEndpointLogMinute.bucket < cutoff
+        ).order_by(DbEndpointLogMinute.uid).limit(COMPACTION_BATCH_SIZE).all()
+        if not rows:
+            return rolled
+
+        rollups = defaultdict(Rollup)
+        for row in rows:
+            rollups[(row.endpointId, hour_bucket(row.bucket))].merge_row(row)
+        _store_rollups(db, DbEndpointLogHour, rollups)
+        db.query(DbEndpointLogMinute).filter(DbEndpointLogMinute.uid.in_([row.uid for row in rows])).delete(synchronize_session=False)
+        db.commit()
+        rolled += len(rows)
+
+
+def _delete_expired(db: Session, endpoint_ids: List[int], cutoff: datetime):
+    for model, column in ((DbEndpointLog, DbEndpointLog.timestamp), (DbEndpointLogMinute, DbEndpointLogMinute.bucket), (DbEndpointLogHour, DbEndpointLogHour.bucket), (DbOutage, DbOutage.end)):
+        while True:
+            uids = [uid for (uid,) in db.query(model.uid).filter(model.endpointId.in_(endpoint_ids), column < cutoff).limit(COMPACTION_BATCH_SIZE)]
+            if not uids:
+                break
+            db.query(model).filter(model.uid.in_(uids)).delete(synchronize_session=False)
+            db.commit()
+
+
+def compact_logs(db: Session, now: Optional[datetime] = None):
+    """Apply retention and downsampling to every endpoint's logs.
+
+    Endpoints are grouped by their application's timeToKeep so each
+    retention period is handled with one pass of batched queries.
+    """
+    now = now or datetime.utcnow()
+    keep_by_app = {}
+    for uid, time_to_keep in db.query(DbApplication.uid, DbApplication.timeToKeep):
+        try:
+            keep_by_app[uid] = time_to_seconds(time_to_keep)
+        except (ValueError, AttributeError):
+            continue
+
+    groups = defaultdict(list)
+    for endpoint_id, app_id in db.query(DbEndpoint.uid, DbEndpoint.applicationId):
+        if app_id in keep_by_app:
+            groups[keep_by_app[app_id]].append(endpoint_id)
+
+    for time_to_keep, endpoint_ids in groups.items():
+        for start in range(0, len(endpoint_ids), COMPACTION_BATCH_SIZE):
+            chunk = endpoint_ids[start:start + COMPACTION_BATCH_SIZE]
+            _delete_expired(db, chunk, now - timedelta(seconds=time_to_keep))
+            _roll_raw_logs(db, chunk, now - timedelta(seconds=min(RAW_LOG_RETENTION, time_to_keep)))
+            _roll_minute_rollups(db, chunk, minute_bucket(now - timedelta(seconds=min(MINUTE_ROLLUP_RETENTION, time_to_keep))))
+
+
+def run_compaction():
+    with session_scope() as db:
+        compact_logs(db)
+
+
+async def compaction_loop():
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL)
+        if not shard_manager.leads():
+            continue
+        try:
+            await asyncio.to_thread(run_compaction)
+        except Exception as e:
+            errors.inc("compaction")
+            print(f"Log compaction failed: {e}")
@@ -0,0 +1,186 @@
+import asyncio
+from typing import Dict, Optional, Set, Tuple, Union
+from internal.admin import WS_QUEUE_SIZE
+from routers.serialization import dumps_text
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Subprotocols a client can ask for. Clients that ask for none get the
+# original protocol: the full application document on every update.
+SUBPROTOCOLS = {
+    "itec.v2.json": (2, "json"),
+    "itec.v2.msgpack": (2, "msgpack"),
+}
+
+Message = Tuple[str, Union[str, bytes]]
+
+
+def encode(payload, encoding: str) -> Message:
+    if encoding == "msgpack":
+        return "bytes", msgpack.packb(payload)
+    return "text", dumps_text(payload)
+
+
+def negotiate(requested) -> Tuple[Optional[str], int, str]:
+    """Pick the first supported subprotocol, return (subprotocol, version, encoding)."""
+    for subprotocol in requested:
+        if subprotocol in SUBPROTOCOLS:
+            version, encoding = SUBPROTOCOLS[subprotocol]
+            if encoding == "msgpack" and msgpack is None:
+                continue
+            return subprotocol, version, encoding
+    return None, 1, "json"
+
+
+def diff_snapshots(previous: dict, current: dict) -> dict:
+    """Changes between two application snapshots.
+
+    Top level fields that changed go under "app". Endpoints are matched by
+    uid: new or changed endpoints carry their changed fields and any new
+    log entries, deleted ones are listed under "removed".
+    """
+    changes = {}
+    app = {key: value for key, value in current.items() if key != "endpoints" and previous.get(key) != value}
+    if app:
+        changes["app"] = app
+
+    previous_endpoints = {endpoint["uid"]: endpoint for endpoint in previous.get("endpoints", [])}
+    changed = []
+    for endpoint in current.get("endpoints", []):
+        before = previous_endpoints.pop(endpoint["uid"], None)
+        if before is None:
+            changed.append(endpoint)
+            continue
+        fields = {key: value for key, value in endpoint.items() if key != "log" and before.get(key) != value}
+        seen = {log["uid"] for log in before.get("log", [])}
+        new_logs = [log for log in endpoint.get("log", []) if log["uid"] not in seen]
+        if fields or new_logs:
+            changed.append({"uid": endpoint["uid"], **fields, "log": new_logs})
+    if changed:
+        changes["endpoints"] = changed
+    if previous_endpoints:
+        changes["removed"] = list(previous_endpoints)
+    return changes
+
+
+class Subscriber:
+    """Bounded outbox of one WebSocket client, a slow client loses the oldest messages."""
+
+    def __init__(self, max_queue: int, version: int = 1, encoding: str = "json"):
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.version = version
+        self.encoding = encoding
+
+    def push(self, message: Message) -> bool:
+        """Queue a message, return True if an older one had to be dropped."""
+        dropped = self.queue.full()
+        if dropped:
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+        return dropped
+
+    def reset(self, message: Message):
+        """Replace everything queued with a single message."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+
+class Channel:
+    def __init__(self, snapshot: dict):
+        self.subscribers: Set[Subscriber] = set()
+        self.snapshot = snapshot
+        self.seq = 0
+
+
+class BroadcastHub:
+    """Fans the state of an application out to every client watching it.
+
+    The monitor publishes once per probe cycle. Each message, whether a full
+    document, a snapshot or a delta, is serialized once per encoding in use,
+    whatever the number of subscribers.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._channels: Dict[int, Channel] = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, app_id: int, snapshot: dict, version: int = 1, encoding: str = "json") -> Subscriber:
+        """Subscribe to an app; snapshot is its current state, read by the caller."""
+        channel = self._channels.get(app_id)
+        if channel is None:
+            channel = self._channels[app_id] = Channel(snapshot)
+        subscriber = Subscriber(self.queue_size, version, encoding)
+        channel.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, app_id: int, subscriber: Subscriber):
+        channel = self._channels.get(app_id)
+        if channel is not None:
+            channel.subscribers.discard(subscriber)
+            if not channel.subscribers:
+                del self._channels[app_id]
+
+    def subscribed_apps(self) -> Set[int]:
+        return set(self._channels)
+
+    def snapshot_message(self, app_id: int, subscriber: Subscriber) -> Message:
+        """The message a client receives right after subscribing."""
+        channel = self._channels[app_id]
+        if subscriber.version == 1:
+            return encode(channel.snapshot, "json")
+        return encode({"type": "snapshot", "seq": channel.seq, "data": channel.snapshot}, subscriber.encoding)
+
+    def publish(self, app_id: int, snapshot: dict):
+        channel = self._channels.get(app_id)
+        if channel is None:
+            return
+        changes = diff_snapshots(channel.snapshot, snapshot)
+        if not changes:
+            return
+        channel.seq += 1
+        channel.snapshot = snapshot
+        self.published += 1
+
+        cache = {}
+
+        def message(kind: str, encoding: str) -> Message:
+            if (kind, encoding) not in cache:
+                if kind == "full":
+                    payload = snapshot
+                elif kind == "snapshot":
+                    payload = {"type": "snapshot", "seq": channel.seq, "data": snapshot}
+                else:
+                    payload = {"type": "delta", "seq": channel.seq, **changes}
+                cache[(kind, encoding)] = encode(payload, encoding)
+            return cache[(kind, encoding)]
+
+        for subscriber in channel.subscribers:
+            if subscriber.version == 1:
+                dropped = subscriber.push(message("full", "json"))
+            else:
+                dropped = subscriber.push(message("delta", subscriber.encoding))
+                if dropped:
+                    # A lost delta breaks the sequence, resynchronize with a snapshot
+                    subscriber.reset(message("snapshot", subscriber.encoding))
+            self.delivered += 1
+            if dropped:
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "apps": len(self._channels),
+            "subscribers": sum(len(channel.subscribers) for channel in self._channels.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+hub = BroadcastHub(WS_QUEUE_SIZE)
@@ -0,0 +1,52 @@
+import asyncio
+import httpx
+from sqlalchemy import select, update
+from database.database import async_session_scope
+from database.models import DbApplication, DbIpInfo
+from internal.admin import IP_REFRESH_INTERVAL
+from internal.metrics import errors
+from background.shards import shard_manager
+from background.probe import base_host
+from background.resolver import resolver
+
+
+async def refresh_ip_info() -> int:
+    """Store the current address of every application, return the rows changed.
+
+    A host that no longer resolves keeps its last known address, so a
+    transient DNS failure does not wipe it.
+    """
+    async with async_session_scope() as db:
+        rows = (await db.execute(
+            select(DbIpInfo.uid, DbIpInfo.address, DbApplication.baseUrl).join(DbApplication, DbIpInfo.applicationId == DbApplication.uid)
+        )).all()
+
+        hosts = {}
+        for row in rows:
+            try:
+                hosts[row.uid] = base_host(row.baseUrl)
+            except httpx.InvalidURL:
+                continue
+        unique_hosts = list(set(hosts.values()))
+        addresses = dict(zip(unique_hosts, await asyncio.gather(*(resolver.resolve(host) for host in unique_hosts))))
+
+        changed = []
+        for row in rows:
+            address = addresses.get(hosts.get(row.uid))
+            if address is not None and address != row.address:
+                changed.append({"uid": row.uid, "address": address})
+        if changed:
+            await db.execute(update(DbIpInfo), changed)
+    return len(changed)
+
+
+async def ip_refresh_loop():
+    while True:
+        await asyncio.sleep(IP_REFRESH_INTERVAL)
+        if not shard_manager.leads():
+            continue
+        try:
+            await refresh_ip_info()
+        except Exception as e:
+            errors.inc("ipinfo")
+            print(f"IpInfo refresh failed: {e}")
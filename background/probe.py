@@ -0,0 +1,173 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+import httpcore
+import httpx
+from internal.admin import PROBE_TIMEOUT, PROBE_MAX_CONCURRENCY, PROBE_PER_HOST_CONCURRENCY
+from background.resolver import DnsResolver, ResolvingBackend, resolver
+
+
+def endpoint_url(base_url: str, relative_url: str) -> str:
+    if relative_url.startswith('/'):
+        relative_url = relative_url[1:]
+    return "https://" + base_url + "/" + relative_url
+
+
+def base_host(base_url: str) -> str:
+    """Host name of an application's baseUrl, which may carry a port."""
+    return httpx.URL("https://" + base_url).host
+
+
+# httpcore failures surfaced to httpx as its own TransportError subclasses
+HTTPCORE_ERRORS = (httpcore.ProtocolError, httpcore.NetworkError, httpcore.TimeoutException, httpcore.UnsupportedProtocol, httpcore.ProxyError)
+
+
+def transport_error(exc: Exception) -> Exception:
+    """The httpx exception matching an httpcore one, both libraries use the same names."""
+    for cls in type(exc).__mro__:
+        if cls.__module__.startswith("httpcore"):
+            mapped = getattr(httpx, cls.__name__, None)
+            if isinstance(mapped, type) and issubclass(mapped, httpx.TransportError):
+                return mapped(str(exc))
+    return httpx.TransportError(str(exc))
+
+
+class ResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream):
+        self.stream = stream
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.stream:
+                yield chunk
+        except HTTPCORE_ERRORS as exc:
+            raise transport_error(exc) from exc
+
+    async def aclose(self):
+        if hasattr(self.stream, "aclose"):
+            await self.stream.aclose()
+
+
+class ResolvingTransport(httpx.AsyncBaseTransport):
+    """httpx transport over an httpcore pool that resolves hosts through a DnsResolver."""
+
+    def __init__(self, resolver: DnsResolver, limits: httpx.Limits):
+        self.pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            network_backend=ResolvingBackend(resolver),
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(scheme=request.url.raw_scheme, host=request.url.raw_host, port=request.url.port, target=request.url.raw_path),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        )
+        try:
+            response = await self.pool.handle_async_request(core_request)
+        except HTTPCORE_ERRORS as exc:
+            raise transport_error(exc) from exc
+        return httpx.Response(status_code=response.status, headers=response.headers, stream=ResponseStream(response.stream), extensions=response.extensions)
+
+    async def aclose(self):
+        await self.pool.aclose()
+
+
+class ProbeEngine:
+    """Probes endpoints over one pooled httpx client.
+
+    A global semaphore bounds the number of in-flight probes and a
+    per-host semaphore keeps a single target from taking all of them.
+    Host names are resolved through the shared DNS cache, and a host
+    whose lookup recently failed is reported down without a request.
+
+    Probes of the same URL are coalesced: concurrent callers share the
+    in-flight request. The scheduler fires applications with the same
+    baseUrl together, so those registering the same target do not
+    multiply the traffic it gets. A completed result is never reused, each
+    cycle gets a fresh one.
+    """
+
+    def __init__(self, max_concurrency: int, per_host_concurrency: int, timeout: float, resolver: DnsResolver):
+        self.resolver = resolver
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.requests = 0
+        self.shared = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                transport=ResolvingTransport(self.resolver, httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                )),
+            )
+        return self._client
+
+    def _host_semaphore(self, host: str) -> asyncio.Semaphore:
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = self._hosts[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return semaphore
+
+    async def probe(self, url: str) -> Tuple[str, float]:
+        """Return the (status, response time in seconds) of a GET on url.
+
+        Any failure, including a non 2xx response, is reported as a 500
+        with a response time of 0.
+        """
+        pending = self._pending.get(url)
+        if pending is None:
+            self.requests += 1
+            pending = self._pending[url] = asyncio.ensure_future(self._request(url))
+            pending.add_done_callback(lambda _: self._pending.pop(url, None))
+        else:
+            self.shared += 1
+        # A cancelled caller must not cancel the request of the others
+        return await asyncio.shield(pending)
+
+    async def _request(self, url: str) -> Tuple[str, float]:
+        try:
+            host = httpx.URL(url).host
+            if self.resolver.unresolvable(host):
+                return "500", 0
+            # Queue on the host first, so probes waiting for a busy host do
+            # not hold global slots other hosts could use
+            async with self._host_semaphore(host), self._global:
+                response = await self.client.get(url)
+            response.raise_for_status()
+            return str(response.status_code), response.elapsed.total_seconds()
+        except (httpx.HTTPError, httpx.InvalidURL):
+            return "500", 0
+
+    async def probe_many(self, urls: List[str]) -> List[Tuple[str, float]]:
+        return await asyncio.gather(*(self.probe(url) for url in urls))
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "shared": self.shared, "inFlight": len(self._pending)}
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+probe_engine = ProbeEngine(
+    max_concurrency=PROBE_MAX_CONCURRENCY,
+    per_host_concurrency=PROBE_PER_HOST_CONCURRENCY,
+    timeout=PROBE_TIMEOUT,
+    resolver=resolver,
+)
@@ -0,0 +1,118 @@
+import asyncio
+import ipaddress
+import socket
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+import httpcore
+from internal.admin import DNS_CACHE_TTL, DNS_NEGATIVE_TTL
+
+
+class DnsEntry(NamedTuple):
+    # Every address of the host in resolver order, empty if the lookup failed
+    addresses: Tuple[str, ...]
+    expires: float
+
+
+class DnsResolver:
+    """Host name lookups shared by the probe engine and ipInfo.
+
+    Lookups go through the event loop's getaddrinfo, so they never block
+    it. The system resolver does not expose record TTLs, so an address is
+    reused for ttl seconds and a failed lookup for negative_ttl seconds.
+    Concurrent lookups of the same host share one query.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: Dict[str, DnsEntry] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def _fresh(self, host: str) -> Optional[DnsEntry]:
+        entry = self._entries.get(host)
+        if entry is not None and entry.expires > time.monotonic():
+            return entry
+        return None
+
+    def unresolvable(self, host: str) -> bool:
+        """True while a failed lookup of host is cached."""
+        entry = self._fresh(host)
+        return entry is not None and not entry.addresses
+
+    async def resolve(self, host: str) -> Optional[str]:
+        """Return the first address of host, or None if it does not resolve."""
+        addresses = await self.resolve_all(host)
+        return addresses[0] if addresses else None
+
+    async def resolve_all(self, host: str) -> Tuple[str, ...]:
+        """Return every address of host, empty if it does not resolve."""
+        try:
+            ipaddress.ip_address(host)
+            return (host,)
+        except ValueError:
+            pass
+
+        entry = self._fresh(host)
+        if entry is not None:
+            self.hits += 1
+            return entry.addresses
+
+        self.misses += 1
+        pending = self._pending.get(host)
+        if pending is None:
+            pending = self._pending[host] = asyncio.ensure_future(self._lookup(host))
+            pending.add_done_callback(lambda _: self._pending.pop(host, None))
+        return await asyncio.shield(pending)
+
+    async def _lookup(self, host: str) -> Tuple[str, ...]:
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+            addresses = tuple(dict.fromkeys(info[4][0] for info in infos))
+        except (socket.gaierror, UnicodeError):
+            addresses = ()
+        if addresses:
+            self._entries[host] = DnsEntry(addresses, time.monotonic() + self.ttl)
+        else:
+            self.failures += 1
+            self._entries[host] = DnsEntry(addresses, time.monotonic() + self.negative_ttl)
+        return addresses
+
+    def stats(self) -> dict:
+        return {"hosts": len(self._entries), "hits": self.hits, "misses": self.misses, "failures": self.failures}
+
+
+class ResolvingBackend(httpcore.AsyncNetworkBackend):
+    """Network backend that connects to the addresses cached by a DnsResolver.
+
+    Addresses are tried in resolver order until one accepts the connection,
+    so a dual-stack host with an unreachable first address still connects.
+    Only the TCP connection uses the address, TLS still verifies the
+    certificate against the host name of the URL.
+    """
+
+    def __init__(self, resolver: DnsResolver):
+        self.resolver = resolver
+        self.backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        addresses = await self.resolver.resolve_all(host)
+        if not addresses:
+            raise httpcore.ConnectError(f"Could not resolve {host}")
+        for address in addresses[:-1]:
+            try:
+                return await self.backend.connect_tcp(address, port, timeout=timeout, local_address=local_address, socket_options=socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout):
+                continue
+        return await self.backend.connect_tcp(addresses[-1], port, timeout=timeout, local_address=local_address, socket_options=socket_options)
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float):
+        await self.backend.sleep(seconds)
+
+
+resolver = DnsResolver(ttl=DNS_CACHE_TTL, negative_ttl=DNS_NEGATIVE_TTL)
@@ -0,0 +1,279 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+import zlib
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import DbApplication
+from routers.utils import time_to_seconds
+from internal.metrics import scheduler_lag, errors
+from internal.admin import SCHEDULE_JITTER, SCHEDULE_FAST_FACTOR, SCHEDULE_MIN_INTERVAL, SCHEDULE_FAST_CYCLES, SCHEDULE_BACKOFF_AFTER, SCHEDULE_BACKOFF_STEP, SCHEDULE_BACKOFF_MAX
+
+
+class Cadence:
+    """Outcome streaks of an application and the factor applied to its interval."""
+
+    def __init__(self):
+        # Fast cycles spent in the current incident, which only ends after
+        # a run of healthy cycles, so a flapping target exhausts it too
+        self.fast_cycles = 0
+        self.healthy = 0
+        self.factor = 1.0
+
+
+class MonitorScheduler:
+    """Fires probe cycles for every application from a single task.
+
+    Next due times live in a heap keyed by monotonic time. Rescheduling or
+    cancelling an application only touches the entry table; stale heap
+    items are skipped when they surface.
+
+    Intervals adapt to the outcome of each cycle, reported by the runner:
+    failing applications are probed faster for at most fast_cycles cycles
+    per incident, which only ends after backoff_after healthy cycles in a
+    row, and long healthy ones back off up to backoff_max times their
+    interval.
+    Cycles run on a grid of the current interval, offset by a phase
+    derived from a hash of the application's target. Different targets
+    are spread over the interval instead of firing in lockstep, while
+    applications registering the same target fire together, so the probe
+    engine sends one request for all of them.
+    """
+
+    def __init__(self, jitter: float = 0.0, fast_factor: float = 1.0, min_interval: float = 1, fast_cycles: int = 0,
+                 backoff_after: int = 0, backoff_step: float = 1.0, backoff_max: float = 1.0):
+        self.jitter = jitter
+        self.fast_factor = fast_factor
+        self.min_interval = min_interval
+        self.fast_cycles = fast_cycles
+        self.backoff_after = backoff_after
+        self.backoff_step = backoff_step
+        self.backoff_max = backoff_max
+        self._heap: List[Tuple[float, int, int]] = []
+        self._entries: Dict[int, Tuple[float, int]] = {}
+        self._cadence: Dict[int, Cadence] = {}
+        # Offset of each application's grid, as a fraction of its interval
+        self._phases: Dict[int, float] = {}
+        # Applications this process may probe, every one when None
+        self.accepts: Optional[Callable[[int], bool]] = None
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[Callable[[int], Awaitable[None]]] = None
+        self._in_flight: Dict[int, asyncio.Task] = {}
+        self.cycles = 0
+        self.skipped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+
+    def schedule(self, app_id: int, interval: float, target: Optional[str] = None, delay: Optional[float] = None):
+        """Add an application or change its interval or target.
+
+        target is the baseUrl the application probes, applications without
+        one get a phase of their own. Scheduling an application again with
+        the same interval and target is a no-op, so it is never probed
+        twice per interval.
+        """
+        if self._from_thread(self.schedule, app_id, interval, target, delay):
+            return
+        if self.accepts is not None and not self.accepts(app_id):
+            return
+        interval = max(interval, 1)
+        phase = self._phase(target if target is not None else f"app-{app_id}")
+        entry = self._entries.get(app_id)
+        if entry is not None and entry[0] == interval and self._phases.get(app_id) == phase:
+            return
+        self._cadence.pop(app_id, None)
+        self._phases[app_id] = phase
+        now = time.monotonic()
+        self._push(app_id, interval, now + delay if delay is not None else self._next_due(app_id, interval, interval, now))
+
+    def _push(self, app_id: int, interval: float, due: float):
+        seq = next(self._counter)
+        self._entries[app_id] = (interval, seq)
+        heapq.heappush(self._heap, (due, seq, app_id))
+        self._compact()
+        self._wakeup.set()
+
+    def cancel(self, app_id: int):
+        if self._from_thread(self.cancel, app_id):
+            return
+        self._entries.pop(app_id, None)
+        self._cadence.pop(app_id, None)
+        self._phases.pop(app_id, None)
+
+    def _from_thread(self, method, *args) -> bool:
+        """Hand a call made from a threadpool route over to the scheduler's loop.
+
+        The heap and the wakeup event belong to the loop, Event.set from
+        another thread would not wake it.
+        """
+        if self._loop is None:
+            return False
+        try:
+            if asyncio.get_running_loop() is self._loop:
+                return False
+        except RuntimeError:
+            pass
+        self._loop.call_soon_threadsafe(method, *args)
+        return True
+
+    def report(self, app_id: int, healthy: bool):
+        """Adapt the cadence of an application to the outcome of its last cycle."""
+        entry = self._entries.get(app_id)
+        if entry is None:
+            return
+        interval = entry[0]
+        cadence = self._cadence.get(app_id)
+        if cadence is None:
+            cadence = self._cadence[app_id] = Cadence()
+        previous = cadence.factor
+        if healthy:
+            cadence.healthy += 1
+            if cadence.healthy >= self.backoff_after:
+                cadence.fast_cycles = 0
+            if cadence.healthy > self.backoff_after:
+                cadence.factor = min(max(cadence.factor, 1.0) * self.backoff_step, self.backoff_max)
+            else:
+                cadence.factor = 1.0
+        else:
+            cadence.healthy = 0
+            if cadence.fast_cycles < self.fast_cycles:
+                cadence.fast_cycles += 1
+                # Never below min_interval, unless the configured interval already is
+                cadence.factor = max(self.fast_factor, min(1.0, self.min_interval / interval))
+            else:
+                cadence.factor = 1.0
+        if cadence.factor < previous:
+            # Pull the next cycle in rather than wait out the slower cadence
+            self._push(app_id, interval, self._next_due(app_id, interval, interval * cadence.factor, time.monotonic()))
+
+    def _phase(self, target: str) -> float:
+        # crc32 rather than hash(), which is salted per process
+        return self.jitter * zlib.crc32(target.encode()) / 2 ** 32
+
+    def _period(self, app_id: int, interval: float) -> float:
+        cadence = self._cadence.get(app_id)
+        return interval * (cadence.factor if cadence is not None else 1.0)
+
+    def _next_due(self, app_id: int, interval: float, period: float, now: float) -> float:
+        """First point after now of the application's grid.
+
+        The offset scales with the configured interval, not the adapted
+        period, so applications of a target sharing an interval stay in
+        phase whatever their cadence: a backed off grid is a subset of the
+        normal one and a fast grid a superset.
+        """
+        offset = self._phases.get(app_id, 0.0) * interval
+        return offset + (math.floor((now - offset) / period) + 1) * period
+
+    def is_scheduled(self, app_id: int) -> bool:
+        return app_id in self._entries
+
+    def scheduled_apps(self) -> List[int]:
+        return list(self._entries)
+
+    def _compact(self):
+        # Drop stale heap items once they outnumber the live ones
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [item for item in self._heap if self._entries.get(item[2], (None, None))[1] == item[1]]
+            heapq.heapify(self._heap)
+
+    def start(self, runner: Callable[[int], Awaitable[None]]):
+        self._runner = runner
+        self._loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight.values(), return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, seq, app_id = heapq.heappop(self._heap)
+                entry = self._entries.get(app_id)
+                if entry is None or entry[1] != seq:
+                    continue
+                self._record_lag(now - due)
+                if app_id in self._in_flight:
+                    # The previous cycle is still running, skip this one
+                    self.skipped += 1
+                else:
+                    self._in_flight[app_id] = asyncio.create_task(self._fire(app_id))
+                next_due = self._next_due(app_id, entry[0], self._period(app_id, entry[0]), now)
+                heapq.heappush(self._heap, (next_due, seq, app_id))
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, app_id: int):
+        try:
+            await self._runner(app_id)
+        except Exception as e:
+            errors.inc("scheduler")
+            print(f"Probe cycle for app {app_id} failed: {e}")
+        finally:
+            self._in_flight.pop(app_id, None)
+
+    def _record_lag(self, lag: float):
+        self.cycles += 1
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.total_lag += lag
+        scheduler_lag.observe(lag)
+
+    def stats(self) -> dict:
+        return {
+            "scheduled": len(self._entries),
+            "inFlight": len(self._in_flight),
+            "cycles": self.cycles,
+            "skipped": self.skipped,
+            "fast": sum(1 for cadence in self._cadence.values() if cadence.factor < 1),
+            "backedOff": sum(1 for cadence in self._cadence.values() if cadence.factor > 1),
+            "lastLag": self.last_lag,
+            "maxLag": self.max_lag,
+            "meanLag": self.total_lag / self.cycles if self.cycles else 0.0,
+        }
+
+
+scheduler = MonitorScheduler(
+    jitter=SCHEDULE_JITTER,
+    fast_factor=SCHEDULE_FAST_FACTOR,
+    min_interval=SCHEDULE_MIN_INTERVAL,
+    fast_cycles=SCHEDULE_FAST_CYCLES,
+    backoff_after=SCHEDULE_BACKOFF_AFTER,
+    backoff_step=SCHEDULE_BACKOFF_STEP,
+    backoff_max=SCHEDULE_BACKOFF_MAX,
+)
+
+
+async def schedule_applications(db: AsyncSession, *criteria) -> Set[int]:
+    """Schedule the matching applications, returns the uids found."""
+    found = set()
+    for uid, refresh_interval, base_url in await db.execute(select(DbApplication.uid, DbApplication.refreshInterval, DbApplication.baseUrl).where(*criteria)):
+        found.add(uid)
+        try:
+            scheduler.schedule(uid, time_to_seconds(refresh_interval), base_url)
+        except (ValueError, AttributeError) as e:
+            print(f"Cannot schedule app {uid}: {e}")
+    return found
@@ -0,0 +1,232 @@
+import asyncio
+import math
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set, Tuple
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from database.database import async_session_scope
+from database.models import DbApplication, DbEndpoint, DbEndpointStats, DbShardLease, DbWorker
+from internal.admin import SHARDING, SHARD_COUNT, SHARD_HEARTBEAT, SHARD_LEASE_TTL, SHARD_RELAY_INTERVAL, WORKER_ID
+from internal.metrics import errors
+from background.hub import hub
+from background.scheduler import scheduler, schedule_applications
+from routers.utils import build_app_snapshot
+
+
+class ShardManager:
+    """Splits the monitored applications between worker processes.
+
+    Applications are grouped into shard_count shards by uid. Each worker
+    heartbeats in the worker table and leases its fair share of the shards
+    in shardLease, renewing the leases on every heartbeat. A lease is taken
+    with a conditional update, so a shard has a single owner at a time.
+    The leases of a dead worker expire and are claimed by the others, and
+    a worker that joins makes the others release their surplus.
+
+    Lease expiry uses each worker's clock, they are expected to be in sync
+    to well within ttl.
+    """
+
+    def __init__(self, shard_count: int, ttl: float, enabled: bool = True, worker_id: Optional[str] = None):
+        self.shard_count = shard_count
+        self.ttl = ttl
+        self.enabled = enabled
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.owned: Set[int] = set()
+        self.workers = 0
+        self.rebalances = 0
+        self._seeded = False
+        # Monotonic time until which the owned leases are known to be held
+        self._valid_until = 0.0
+
+    def shard(self, app_id: int) -> int:
+        return app_id % self.shard_count
+
+    def owns(self, app_id: int) -> bool:
+        return not self.enabled or self.shard(app_id) in self.owned
+
+    def leads(self) -> bool:
+        """True on the one worker that runs the jobs covering every application."""
+        return not self.enabled or 0 in self.owned
+
+    def app_filter(self, shards: Set[int]):
+        return (DbApplication.uid % self.shard_count).in_(shards)
+
+    async def _seed(self):
+        # Every worker tries to create the missing leases, the losers of the
+        # race roll back and find them created
+        try:
+            async with async_session_scope() as db:
+                existing = set(await db.scalars(select(DbShardLease.shard)))
+                missing = [{"shard": shard} for shard in range(self.shard_count) if shard not in existing]
+                if missing:
+                    await db.execute(insert(DbShardLease), missing)
+        except IntegrityError:
+            pass
+        self._seeded = True
+
+    async def rebalance(self) -> Tuple[Set[int], Set[int]]:
+        """Heartbeat, renew the owned leases and move toward a fair share.
+
+        Returns the shards gained and lost since the previous call.
+        """
+        if not self._seeded:
+            await self._seed()
+        started = time.monotonic()
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=self.ttl)
+        async with async_session_scope() as db:
+            beat = await db.execute(update(DbWorker).where(DbWorker.id == self.worker_id).values(heartbeat=now))
+            if beat.rowcount == 0:
+                await db.execute(insert(DbWorker).values(id=self.worker_id, heartbeat=now))
+            await db.execute(delete(DbWorker).where(DbWorker.heartbeat < now - timedelta(seconds=self.ttl)))
+            self.workers = max(await db.scalar(select(func.count()).select_from(DbWorker)), 1)
+            share = math.ceil(self.shard_count / self.workers)
+
+            await db.execute(update(DbShardLease).where(DbShardLease.owner == self.worker_id).values(expires=expires))
+            owned = set(await db.scalars(select(DbShardLease.shard).where(DbShardLease.owner == self.worker_id)))
+
+            if len(owned) > share:
+                surplus = sorted(owned)[share:]
+                await db.execute(
+                    update(DbShardLease).where(DbShardLease.shard.in_(surplus), DbShardLease.owner == self.worker_id).values(owner=None, expires=None)
+                )
+                owned.difference_update(surplus)
+            elif len(owned) < share:
+                free = or_(DbShardLease.owner.is_(None), DbShardLease.expires < now)
+                candidates = list(await db.scalars(select(DbShardLease.shard).where(free).order_by(DbShardLease.shard).limit(share - len(owned))))
+                for shard in candidates:
+                    claimed = await db.execute(
+                        update(DbShardLease).where(DbShardLease.shard == shard, free).values(owner=self.worker_id, expires=expires)
+                    )
+                    if claimed.rowcount == 1:
+                        owned.add(shard)
+
+        self._valid_until = started + self.ttl
+        self.rebalances += 1
+        gained, lost = owned - self.owned, self.owned - owned
+        self.owned = owned
+        return gained, lost
+
+    def expire(self) -> Set[int]:
+        """Give up the owned shards once their leases may have been taken over."""
+        if time.monotonic() < self._valid_until:
+            return set()
+        lost, self.owned = self.owned, set()
+        return lost
+
+    async def release(self):
+        """Hand the leases back on shutdown so other workers take over at once."""
+        async with async_session_scope() as db:
+            await db.execute(update(DbShardLease).where(DbShardLease.owner == self.worker_id).values(owner=None, expires=None))
+            await db.execute(delete(DbWorker).where(DbWorker.id == self.worker_id))
+        self.owned = set()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "worker": self.worker_id,
+            "workers": self.workers,
+            "shards": self.shard_count,
+            "owned": sorted(self.owned),
+            "rebalances": self.rebalances,
+        }
+
+
+class UpdateRelay:
+    """Publishes to local WebSocket clients the updates of apps probed elsewhere.
+
+    The owning worker's probe writer only publishes to its own hub. For the
+    apps watched here but owned by another worker, the latest probe time of
+    their endpoints is polled and the snapshot rebuilt when it moved.
+    """
+
+    def __init__(self, manager: ShardManager):
+        self.manager = manager
+        self._last_probe: Dict[int, datetime] = {}
+        self.polls = 0
+        self.relayed = 0
+
+    async def poll(self):
+        foreign = [app_id for app_id in hub.subscribed_apps() if not self.manager.owns(app_id)]
+        for app_id in set(self._last_probe) - set(foreign):
+            del self._last_probe[app_id]
+        if not foreign:
+            return
+        self.polls += 1
+        async with async_session_scope() as db:
+            rows = await db.execute(
+                select(DbEndpoint.applicationId, func.max(DbEndpointStats.lastProbe))
+                .join(DbEndpointStats, DbEndpointStats.endpointId == DbEndpoint.uid)
+                .where(DbEndpoint.applicationId.in_(foreign))
+                .group_by(DbEndpoint.applicationId)
+            )
+            for app_id, last_probe in rows.all():
+                if self._last_probe.get(app_id) == last_probe:
+                    continue
+                self._last_probe[app_id] = last_probe
+                snapshot = await build_app_snapshot(app_id, db)
+                if snapshot is not None:
+                    published = hub.published
+                    hub.publish(app_id, snapshot)
+                    self.relayed += hub.published - published
+
+    def stats(self) -> dict:
+        return {"watched": len(self._last_probe), "polls": self.polls, "relayed": self.relayed}
+
+
+shard_manager = ShardManager(SHARD_COUNT, SHARD_LEASE_TTL, enabled=SHARDING, worker_id=WORKER_ID)
+update_relay = UpdateRelay(shard_manager)
+
+
+def cancel_shards(shards: Set[int]):
+    for app_id in scheduler.scheduled_apps():
+        if shard_manager.shard(app_id) in shards:
+            scheduler.cancel(app_id)
+
+
+async def sync_owned_apps():
+    """Bring the scheduler in line with the applications of the owned shards.
+
+    Run on every heartbeat, so applications created, edited or deleted
+    through another worker are picked up within SHARD_HEARTBEAT seconds.
+    Unchanged intervals are left alone by the scheduler.
+    """
+    # Apps scheduled during the query, by a local PUT, are not stale
+    scheduled = scheduler.scheduled_apps()
+    async with async_session_scope() as db:
+        found = await schedule_applications(db, shard_manager.app_filter(shard_manager.owned))
+    for app_id in scheduled:
+        if app_id not in found:
+            scheduler.cancel(app_id)
+
+
+async def shard_loop():
+    while True:
+        await asyncio.sleep(SHARD_HEARTBEAT)
+        try:
+            await shard_manager.rebalance()
+        except Exception as e:
+            errors.inc("shards")
+            print(f"Shard lease renewal failed: {e}")
+            # The database may be unreachable, stop probing without it
+            cancel_shards(shard_manager.expire())
+            continue
+        try:
+            await sync_owned_apps()
+        except Exception as e:
+            errors.inc("shards")
+            print(f"Cannot schedule owned shards: {e}")
+
+
+async def relay_loop():
+    while True:
+        await asyncio.sleep(SHARD_RELAY_INTERVAL)
+        try:
+            await update_relay.poll()
+        except Exception as e:
+            errors.inc("relay")
+            print(f"WebSocket relay failed: {e}")
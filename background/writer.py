@@ -0,0 +1,199 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Set, Tuple
+from sqlalchemy import insert, select, update
+from database.database import async_session_scope
+from database.models import DbApplication, DbEndpoint, DbEndpointLog, DbEndpointStats, DbOutage
+from internal.admin import WRITER_QUEUE_SIZE, WRITER_BATCH_SIZE, WRITER_FLUSH_INTERVAL
+from internal.metrics import errors
+from background.hub import hub
+from routers.utils import STATUS_WINDOW, determine_app_status, init_endpoint_stats, record_endpoint_status, record_outage, build_app_snapshot, latest_logs_query, group_logs
+
+
+class ProbeResult(NamedTuple):
+    endpointId: int
+    status: str
+    responseTime: float
+    timestamp: datetime
+
+
+class AppProbeResult(NamedTuple):
+    appId: int
+    hasBugs: bool
+    results: List[ProbeResult]
+
+
+class ProbeWriter:
+    """Write-behind pipeline between the probe cycles and the database.
+
+    Cycles submit their results to a bounded queue. One task drains it
+    every flush interval, or as soon as a batch is full, and writes the
+    whole batch in a single transaction.
+    """
+
+    def __init__(self, max_queue: int, batch_size: int, flush_interval: float):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.submitted = 0
+        self.blocked = 0
+        self.blocked_time = 0.0
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.last_batch_rows = 0
+        self.last_flush_time = 0.0
+
+    async def submit(self, item: AppProbeResult):
+        self.submitted += 1
+        if self.queue.full():
+            self.blocked += 1
+            start = time.monotonic()
+            await self.queue.put(item)
+            self.blocked_time += time.monotonic() - start
+        else:
+            self.queue.put_nowait(item)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the writer task."""
+        self._stopping = True
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if batch:
+                await self._flush(batch)
+            elif self._stopping:
+                return
+
+    async def _collect(self) -> List[AppProbeResult]:
+        batch = []
+        rows = 0
+        deadline = time.monotonic() + self.flush_interval
+        while rows < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            rows += len(item.results)
+        return batch
+
+    async def _flush(self, batch: List[AppProbeResult]):
+        start = time.monotonic()
+        rows = sum(len(item.results) for item in batch)
+        try:
+            rows, snapshots = await self._write(batch, hub.subscribed_apps())
+            self.rows_written += rows
+            for app_id, snapshot in snapshots:
+                hub.publish(app_id, snapshot)
+        except Exception as e:
+            errors.inc("writer")
+            print(f"Failed to write {rows} probe results: {e}")
+            self.rows_failed += rows
+        self.flushes += 1
+        self.last_batch_rows = rows
+        self.last_flush_time = time.monotonic() - start
+
+    async def _write(self, batch: List[AppProbeResult], subscribed: Set[int]) -> Tuple[int, List[Tuple[int, dict]]]:
+        """Store a batch, then build the new state of the watched apps it touched."""
+        async with async_session_scope() as db:
+            endpoint_ids = {result.endpointId for item in batch for result in item.results}
+            # Endpoints deleted while their probe was queued are dropped
+            existing = set((await db.execute(select(DbEndpoint.uid).where(DbEndpoint.uid.in_(endpoint_ids)))).scalars())
+            stats = {
+                endpoint_stats.endpointId: endpoint_stats
+                for endpoint_stats in (await db.execute(select(DbEndpointStats).where(DbEndpointStats.endpointId.in_(existing)))).scalars()
+            }
+            missing = list(existing - set(stats))
+            if missing:
+                seeds = group_logs(missing, (await db.execute(latest_logs_query(missing, STATUS_WINDOW))).scalars())
+                for endpoint_id in missing:
+                    stats[endpoint_id] = init_endpoint_stats(endpoint_id, [log.status for log in reversed(seeds[endpoint_id])], db)
+            outages = {
+                outage.endpointId: outage
+                for outage in (await db.execute(select(DbOutage).where(DbOutage.endpointId.in_(existing), DbOutage.end.is_(None)))).scalars()
+            }
+
+            logs = []
+            endpoint_statuses = {}
+            app_statuses = {}
+            for item in batch:
+                statuses = []
+                for result in item.results:
+                    if result.endpointId not in existing:
+                        continue
+                    logs.append({
+                        "endpointId": result.endpointId,
+                        "status": result.status,
+                        "responseTime": result.responseTime,
+                        "timestamp": result.timestamp,
+                    })
+                    stability = record_endpoint_status(stats[result.endpointId], result.status, result.timestamp)
+                    outages[result.endpointId] = record_outage(outages.get(result.endpointId), result.endpointId, result.status, result.timestamp, db)
+                    endpoint_statuses[result.endpointId] = stability
+                    statuses.append(stability)
+                app_statuses[item.appId] = determine_app_status(statuses, item.hasBugs)
+
+            if logs:
+                await db.execute(insert(DbEndpointLog), logs)
+            if endpoint_statuses:
+                await db.execute(update(DbEndpoint), [{"uid": uid, "status": status} for uid, status in endpoint_statuses.items()])
+            if app_statuses:
+                existing_apps = set((await db.execute(select(DbApplication.uid).where(DbApplication.uid.in_(app_statuses)))).scalars())
+                app_updates = [{"uid": uid, "status": status} for uid, status in app_statuses.items() if uid in existing_apps]
+                if app_updates:
+                    await db.execute(update(DbApplication), app_updates)
+            await db.commit()
+
+            snapshots = []
+            for app_id in app_statuses:
+                if app_id not in subscribed:
+                    continue
+                # One app failing to build must not hold back the others' updates
+                try:
+                    snapshot = await build_app_snapshot(app_id, db)
+                except Exception as e:
+                    errors.inc("writer")
+                    print(f"Failed to build the update of app {app_id}: {e}")
+                    await db.rollback()
+                    continue
+                if snapshot is not None:
+                    snapshots.append((app_id, snapshot))
+            return len(logs), snapshots
+
+    def stats(self) -> dict:
+        return {
+            "queueDepth": self.queue.qsize(),
+            "queueCapacity": self.max_queue,
+            "submitted": self.submitted,
+            "blockedSubmits": self.blocked,
+            "blockedSeconds": self.blocked_time,
+            "flushes": self.flushes,
+            "rowsWritten": self.rows_written,
+            "rowsFailed": self.rows_failed,
+            "lastBatchRows": self.last_batch_rows,
+            "lastFlushSeconds": self.last_flush_time,
+        }
+
+
+probe_writer = ProbeWriter(
+    max_queue=WRITER_QUEUE_SIZE,
+    batch_size=WRITER_BATCH_SIZE,
+    flush_interval=WRITER_FLUSH_INTERVAL,
+)
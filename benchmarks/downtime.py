@@ -0,0 +1,100 @@
+"""Cost of the downtime computation as log volume grows.
+
+Run from the repository root:
+
+    python -m benchmarks.downtime
+
+Each endpoint gets the same ten outages spread over a growing number of
+probes. The old nested scan over the log grows with the log, the sum over
+outage intervals written at probe time does not.
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DB_PATH", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from database.database import Base, engine, SessionLocal, AsyncSessionLocal
+from database.models import DbApplication, DbEndpoint, DbEndpointLog
+from routers.utils import calculate_downtime_minutes, record_outage
+
+SIZES = (1000, 10000, 100000)
+OUTAGES = 10
+OUTAGE_LENGTH = 20
+REPEAT = 5
+
+
+def legacy_downtime(logs) -> float:
+    # The nested loop calculate_downtime_minutes used to run over endpoint.log
+    total_downtime = 0.0
+    for timestamp, status in logs:
+        if status != '200':
+            downtime_start = timestamp
+            downtime_end = downtime_start
+            for subsequent_timestamp, subsequent_status in logs:
+                if subsequent_timestamp > downtime_end:
+                    if subsequent_status == '200':
+                        break
+                    else:
+                        downtime_end = subsequent_timestamp
+            if downtime_end > downtime_start:
+                total_downtime += (downtime_end - downtime_start).total_seconds() / 60.0
+    return total_downtime
+
+
+def seed(db, app_id: int, size: int, start: datetime):
+    endpoint = DbEndpoint(relativeUrl=f"/{size}", status="", applicationId=app_id)
+    db.add(endpoint)
+    db.commit()
+
+    spacing = size // OUTAGES
+    logs = []
+    outage = None
+    for i in range(size):
+        timestamp = start + timedelta(seconds=i)
+        status = "500" if i % spacing < OUTAGE_LENGTH else "200"
+        logs.append({"endpointId": endpoint.uid, "status": status, "responseTime": 0.1, "timestamp": timestamp})
+        outage = record_outage(outage, endpoint.uid, status, timestamp, db)
+    db.execute(insert(DbEndpointLog), logs)
+    db.commit()
+    return endpoint.uid
+
+
+async def downtime(endpoint_id: int, since: datetime) -> float:
+    async with AsyncSessionLocal() as db:
+        return await calculate_downtime_minutes([endpoint_id], db, since=since)
+
+
+def timed(func) -> float:
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    app = DbApplication(name=f"downtime-bench-{time.time()}", status="Stable", baseUrl="localhost", refreshInterval="1 sec", timeToKeep="7 days")
+    db.add(app)
+    db.commit()
+
+    start = datetime.utcnow() - timedelta(seconds=max(SIZES))
+    print(f"{'logs':>8} {'legacy ms':>12} {'intervals ms':>14}")
+    for size in SIZES:
+        endpoint_id = seed(db, app.uid, size, start)
+        logs = db.query(DbEndpointLog.timestamp, DbEndpointLog.status).filter(DbEndpointLog.endpointId == endpoint_id).order_by(DbEndpointLog.timestamp).all()
+        legacy = timed(lambda: legacy_downtime(logs))
+        intervals = timed(lambda: asyncio.run(downtime(endpoint_id, start)))
+        print(f"{size:>8} {legacy:>12.2f} {intervals:>14.2f}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Stand-in HTTPS server for the monitored endpoints.
+
+Run from the repository root:
+
+    python -m benchmarks.farm --cert cert.pem --key key.pem
+
+It answers any path on every address 127.0.0.1 .. 127.0.0.<hosts>, so the
+probe engine sees that many distinct hosts. Each request waits an
+exponentially distributed latency, fails with a 500 with probability
+error-rate and hangs for hang seconds with probability hang-rate. Once
+listening it prints "listening <port>".
+"""
+import argparse
+import asyncio
+import random
+import socket
+import ssl
+
+REASONS = {200: "OK", 500: "Internal Server Error"}
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def host_addresses(hosts: int):
+    return [f"127.0.0.{i}" for i in range(1, hosts + 1)]
+
+
+class Farm:
+    def __init__(self, latency: float, error_rate: float, hang_rate: float, hang: float):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang = hang
+
+    async def respond(self) -> int:
+        draw = random.random()
+        if draw < self.hang_rate:
+            await asyncio.sleep(self.hang)
+        if self.latency > 0:
+            await asyncio.sleep(random.expovariate(1 / self.latency))
+        return 500 if draw >= 1 - self.error_rate else 200
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                status = await self.respond()
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: text/plain\r\nContent-Length: 2\r\n\r\nok".encode())
+                await writer.drain()
+        except (ConnectionError, ssl.SSLError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(args):
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(args.cert, args.key)
+    farm = Farm(args.latency, args.error_rate, args.hang_rate, args.hang)
+    port = args.port or free_port()
+    server = await asyncio.start_server(farm.handle, host_addresses(args.hosts), port, ssl=context, backlog=4096)
+    print(f"listening {port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cert", required=True)
+    parser.add_argument("--key", required=True)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--hosts", type=int, default=20, help="loopback addresses to listen on")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean response latency, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--hang-rate", type=float, default=0.001)
+    parser.add_argument("--hang", type=float, default=15.0, help="seconds a hanging request stalls")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(parse_args()))
@@ -0,0 +1,174 @@
+"""Auth caches against a stand-in identity provider.
+
+Run from the repository root:
+
+    python -m benchmarks.idp
+
+A local HTTP server plays the realm's JWKS endpoint and KEYCLOAK_URL is
+pointed at it, so get_payload and the signing key cache run unchanged
+against tokens signed with locally generated RSA keys. Each scenario
+prints PASS or FAIL with the JWKS fetches it caused: cached keys and
+tokens, rotation picked up through an unknown kid, refetches for bogus
+kids throttled to min_refresh, key ttl and token exp honoured, and known
+keys still served while the IdP is down. The exit status is the number
+of failed checks.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.farm import free_port
+
+PORT = free_port()
+os.environ["KEYCLOAK_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ.setdefault("DB_PATH", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "idp.db"))
+
+import rsa
+from fastapi import HTTPException
+from jose import jwt
+from jose.backends import RSAKey
+from auth.auth import get_payload, signing_keys, verified_tokens
+from auth.config import settings
+
+CERTS_PATH = f"/realms/{settings.realm}/protocol/openid-connect/certs"
+
+
+class StandInIdP:
+    """Serves the public half of the current signing keys as a JWKS."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.private = {}
+        self.public = {}
+        self.fetches = 0
+        self._server = None
+
+    def add_key(self, kid: str):
+        public, private = rsa.newkeys(2048)
+        self.private[kid] = private.save_pkcs1().decode()
+        jwk = RSAKey(public.save_pkcs1().decode(), "RS256").to_dict()
+        self.public[kid] = {**jwk, "kid": kid, "use": "sig"}
+
+    def rotate(self, kid: str):
+        """Replace every signing key with a new one, as a realm key rotation does."""
+        self.private.clear()
+        self.public.clear()
+        self.add_key(kid)
+
+    def token(self, kid: str, lifetime: float = 300, key_kid: str = None) -> str:
+        now = int(time.time())
+        claims = {"sub": f"user-{kid}-{time.monotonic_ns()}", "iat": now, "exp": now + int(lifetime), "aud": settings.client_id}
+        return jwt.encode(claims, self.private[key_kid or kid], algorithm="RS256", headers={"kid": kid})
+
+    def start(self):
+        idp = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != CERTS_PATH:
+                    self.send_error(404)
+                    return
+                idp.fetches += 1
+                body = json.dumps({"keys": list(idp.public.values())}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+async def accepted(token: str) -> bool:
+    try:
+        await get_payload(token)
+        return True
+    except HTTPException:
+        return False
+
+
+async def run(args):
+    signing_keys.ttl = args.key_ttl
+    signing_keys.min_refresh = args.min_refresh
+    idp = StandInIdP(PORT)
+    idp.add_key("key-1")
+    idp.start()
+    failures = 0
+
+    def check(name: str, ok: bool, fetches_before: int):
+        nonlocal failures
+        failures += not ok
+        print(f"{'PASS' if ok else 'FAIL'}  {name}  (JWKS fetches: {idp.fetches - fetches_before})")
+
+    try:
+        before = idp.fetches
+        token = idp.token("key-1")
+        ok = await accepted(token) and await accepted(token) and await accepted(idp.token("key-1"))
+        check("first token fetches the keys once, later ones hit the caches", ok and idp.fetches - before == 1 and verified_tokens.hits >= 1, before)
+
+        await asyncio.sleep(args.min_refresh)
+        before = idp.fetches
+        idp.rotate("key-2")
+        ok = await accepted(idp.token("key-2"))
+        check("rotated key is fetched on its unknown kid", ok and idp.fetches - before == 1, before)
+
+        before = idp.fetches
+        ok = not await accepted(idp.token("key-1", key_kid="key-2")) and await accepted(token)
+        check("token already verified stays cached after rotation, a new one with a retired kid is rejected", ok, before)
+
+        # Signed ahead, signing in pure Python is slower than min_refresh
+        bogus = [idp.token(f"bogus-{i}", key_kid="key-2") for i in range(args.bogus)]
+        before = idp.fetches
+        results = await asyncio.gather(*(accepted(token) for token in bogus))
+        check(f"{args.bogus} bogus kids within min_refresh cause at most one refetch", not any(results) and idp.fetches - before <= 1, before)
+
+        await asyncio.sleep(args.key_ttl)
+        before = idp.fetches
+        ok = await accepted(idp.token("key-2"))
+        check("keys are refetched once older than ttl", ok and idp.fetches - before == 1, before)
+
+        before = idp.fetches
+        short = idp.token("key-2", lifetime=args.token_lifetime)
+        ok = await accepted(short)
+        await asyncio.sleep(args.token_lifetime + 1)
+        check("verified token is dropped from the cache at exp", ok and not await accepted(short), before)
+
+        before = idp.fetches
+        idp.stop()
+        await asyncio.sleep(args.key_ttl)
+        ok = await accepted(idp.token("key-2")) and not await accepted(idp.token("unknown", key_kid="key-2"))
+        check("known key is still served while the IdP is down", ok, before)
+    finally:
+        idp.stop()
+
+    print(f"signing keys {signing_keys.stats()}  verified tokens {verified_tokens.stats()}")
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--key-ttl", type=float, default=3.0, help="seconds the signing keys are cached")
+    parser.add_argument("--min-refresh", type=float, default=1.0, help="minimum seconds between refetches for an unknown kid")
+    parser.add_argument("--token-lifetime", type=float, default=2.0, help="seconds until the short lived token expires")
+    parser.add_argument("--bogus", type=int, default=50, help="tokens with an unknown kid sent in a burst")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(parse_args())))
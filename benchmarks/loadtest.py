@@ -0,0 +1,262 @@
+"""End to end load test against a farm of fake targets.
+
+Run from the repository root:
+
+    python -m benchmarks.loadtest --apps 200 --endpoints 10 --output results.json
+
+A self-signed certificate is generated with the openssl CLI and the farm
+of benchmarks/farm.py is started in a subprocess. The database (a temporary
+SQLite file unless DB_PATH is set) is seeded with apps, endpoints and logs,
+then each phase runs in turn:
+
+    probe      one probe of every endpoint through the probe engine
+    pipeline   scheduler, monitor and probe writer running for --duration
+    http       latency of the dashboard routes, in process over ASGI
+    websocket  fan-out latency of the broadcast hub to --subscribers clients
+
+Results are written as JSON, so runs of two versions can be diffed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp()
+os.environ.setdefault("DB_PATH", "sqlite:///" + os.path.join(WORKDIR, "loadtest.db"))
+# The probe client trusts the farm's certificate through the environment
+os.environ["SSL_CERT_FILE"] = os.path.join(WORKDIR, "cert.pem")
+
+from datetime import datetime, timedelta
+import httpx
+import numpy as np
+from sqlalchemy import insert, select
+from database.database import Base, engine, SessionLocal, async_session_scope, async_engine, database_stats
+from database.models import DbApplication, DbEndpoint, DbEndpointLog, DbIpInfo, DbUser
+from background.probe import probe_engine, endpoint_url
+from background.scheduler import scheduler, schedule_applications
+from background.writer import probe_writer
+from background.hub import hub
+from benchmarks.farm import host_addresses
+from routers.application import monitor_endpoints
+from routers.utils import build_app_snapshot
+
+
+def percentiles(samples) -> dict:
+    """Count, p50, p95, p99 and max of samples in seconds, reported in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    values = np.array(samples) * 1000
+    p50, p95, p99 = np.percentile(values, (50, 95, 99))
+    return {"count": len(samples), "p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(values.max())}
+
+
+def make_certificate(hosts: int):
+    names = ",".join(["DNS:localhost"] + [f"IP:{address}" for address in host_addresses(hosts)])
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-keyout", os.path.join(WORKDIR, "key.pem"), "-out", os.environ["SSL_CERT_FILE"],
+        "-subj", "/CN=localhost", "-addext", f"subjectAltName={names}",
+    ], check=True, capture_output=True)
+
+
+async def start_farm(args) -> (asyncio.subprocess.Process, int):
+    farm = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "benchmarks.farm",
+        "--cert", os.environ["SSL_CERT_FILE"], "--key", os.path.join(WORKDIR, "key.pem"),
+        "--hosts", str(args.hosts), "--latency", str(args.latency),
+        "--error-rate", str(args.error_rate), "--hang-rate", str(args.hang_rate),
+        stdout=asyncio.subprocess.PIPE,
+    )
+    line = (await asyncio.wait_for(farm.stdout.readline(), timeout=30)).decode().split()
+    return farm, int(line[1])
+
+
+def seed(args, port: int) -> dict:
+    """Store the apps, endpoints and a history of logs, return what was written."""
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    run = f"loadtest-{int(time.time())}"
+    user = DbUser(username=run, keyclockId=run)
+    db.add(user)
+    db.commit()
+
+    addresses = host_addresses(args.hosts)
+    db.execute(insert(DbApplication), [
+        {
+            "name": f"{run}-app-{i}",
+            "status": "Stable",
+            "baseUrl": f"{addresses[i % len(addresses)]}:{port}",
+            "refreshInterval": f"{args.interval} sec",
+            "timeToKeep": "7 days",
+            "userId": user.uid,
+        }
+        for i in range(args.apps)
+    ])
+    app_ids = list(db.scalars(select(DbApplication.uid).where(DbApplication.userId == user.uid)))
+    db.execute(insert(DbIpInfo), [{"address": "127.0.0.1", "location": "", "timezone": "", "applicationId": app_id} for app_id in app_ids])
+    db.execute(insert(DbEndpoint), [
+        {"relativeUrl": f"/{app_id}/{i}", "status": "Stable", "applicationId": app_id}
+        for app_id in app_ids for i in range(args.endpoints)
+    ])
+    endpoint_ids = list(db.scalars(select(DbEndpoint.uid).where(DbEndpoint.applicationId.in_(app_ids))))
+
+    start = datetime.utcnow() - timedelta(seconds=args.interval * args.logs)
+    for offset in range(0, len(endpoint_ids), 1000):
+        db.execute(insert(DbEndpointLog), [
+            {"endpointId": endpoint_id, "status": "200" if random.random() > args.error_rate else "500", "responseTime": random.expovariate(1 / args.latency), "timestamp": start + timedelta(seconds=args.interval * i)}
+            for endpoint_id in endpoint_ids[offset:offset + 1000] for i in range(args.logs)
+        ])
+    db.commit()
+    db.close()
+    return {"run": run, "appIds": app_ids, "endpointIds": endpoint_ids}
+
+
+async def probe_phase(urls) -> dict:
+    start = time.perf_counter()
+    results = await probe_engine.probe_many(urls)
+    elapsed = time.perf_counter() - start
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    return {"probes": len(urls), "seconds": elapsed, "perSecond": len(urls) / elapsed, "statuses": statuses}
+
+
+async def pipeline_phase(duration: float) -> dict:
+    async with async_session_scope() as db:
+        await schedule_applications(db)
+    written = probe_writer.stats()["rowsWritten"]
+    probe_writer.start()
+    scheduler.start(monitor_endpoints)
+    await asyncio.sleep(duration)
+    await scheduler.stop()
+    await probe_writer.stop()
+    writer = probe_writer.stats()
+    return {
+        "seconds": duration,
+        "scheduler": scheduler.stats(),
+        "writer": writer,
+        "rowsPerSecond": (writer["rowsWritten"] - written) / duration,
+        "database": database_stats(),
+    }
+
+
+async def http_phase(seeded: dict, requests: int) -> dict:
+    from main import app
+
+    routes = {
+        "GET /application/{id}": lambda: f"/application/{random.choice(seeded['appIds'])}",
+        "GET /application/all": lambda: "/application/all",
+        "GET /application/search": lambda: f"/application/search?query=app-{random.randrange(len(seeded['appIds']))}",
+        "GET /application/ratio/{id}": lambda: f"/application/ratio/{random.choice(seeded['endpointIds'])}",
+    }
+    results = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest") as client:
+        for name, path in routes.items():
+            samples = []
+            errors = 0
+            for _ in range(requests):
+                start = time.perf_counter()
+                response = await client.get(path())
+                samples.append(time.perf_counter() - start)
+                errors += response.status_code >= 400
+            results[name] = {**percentiles(samples), "errors": errors}
+    return results
+
+
+async def websocket_phase(app_id: int, subscribers: int, messages: int) -> dict:
+    """Time from publish until each subscriber has the message in hand."""
+    async with async_session_scope() as db:
+        snapshot = await build_app_snapshot(app_id, db)
+    clients = [hub.subscribe(app_id, snapshot, version=2) for _ in range(subscribers)]
+    samples = []
+    try:
+        for i in range(messages):
+            changed = {**snapshot, "status": f"loadtest-{i}"}
+            start = time.perf_counter()
+            hub.publish(app_id, changed)
+
+            async def receive(client):
+                await client.queue.get()
+                samples.append(time.perf_counter() - start)
+
+            await asyncio.gather(*(receive(client) for client in clients))
+    finally:
+        for client in clients:
+            hub.unsubscribe(app_id, client)
+    return {"subscribers": subscribers, "messages": messages, **percentiles(samples)}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    make_certificate(args.hosts)
+    farm, port = await start_farm(args)
+    try:
+        seeded = seed(args, port)
+        async with async_session_scope() as db:
+            endpoints = (await db.execute(
+                select(DbApplication.baseUrl, DbEndpoint.relativeUrl).join(DbEndpoint, DbEndpoint.applicationId == DbApplication.uid).where(DbApplication.uid.in_(seeded["appIds"]))
+            )).all()
+        results = {
+            "meta": {
+                "revision": git_revision(),
+                "startedAt": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "database": engine.dialect.name,
+            },
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+        }
+        results["probe"] = await probe_phase([endpoint_url(base_url, relative_url) for base_url, relative_url in endpoints])
+        results["pipeline"] = await pipeline_phase(args.duration)
+        results["http"] = await http_phase(seeded, args.requests)
+        results["websocket"] = await websocket_phase(seeded["appIds"][0], args.subscribers, args.messages)
+        return results
+    finally:
+        farm.terminate()
+        await farm.wait()
+        await probe_engine.close()
+        await async_engine.dispose()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apps", type=int, default=200)
+    parser.add_argument("--endpoints", type=int, default=10, help="endpoints per app")
+    parser.add_argument("--logs", type=int, default=100, help="stored logs per endpoint")
+    parser.add_argument("--interval", type=int, default=5, help="refresh interval of the apps, in seconds")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds the monitoring pipeline runs")
+    parser.add_argument("--requests", type=int, default=200, help="requests per dashboard route")
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--hosts", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--hang-rate", type=float, default=0.001)
+    parser.add_argument("--output", help="file the JSON results are written to, stdout by default")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    results = asyncio.run(run(args))
+    document = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(document)
+    else:
+        print(document)
+
+
+if __name__ == "__main__":
+    main()
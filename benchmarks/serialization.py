@@ -0,0 +1,93 @@
+"""Cost of serializing a large application document.
+
+Run from the repository root:
+
+    python -m benchmarks.serialization
+
+Compares the pydantic path routes used to take (validate the ORM objects
+into the Application schema, dump and encode with the json module) with
+the documents of routers/serialization.py encoded by dumps, and the
+WebSocket snapshot encoding before and after.
+"""
+import json
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DB_PATH", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from database.database import Base, engine, SessionLocal
+from database.models import DbApplication, DbEndpoint, DbEndpointLog, DbUser
+from routers.schemas import Application
+from routers.serialization import application_document, dumps, orjson
+from routers.utils import group_logs, latest_logs_query
+
+ENDPOINTS = (10, 100, 1000)
+LOGS_PER_ENDPOINT = 20
+REPEAT = 5
+
+
+def seed(db, endpoints: int) -> int:
+    user = DbUser(username="bench", keyclockId=f"bench-{time.time()}")
+    db.add(user)
+    db.commit()
+    app = DbApplication(name=f"serialization-bench-{endpoints}-{time.time()}", status="Stable", baseUrl="localhost", refreshInterval="1 sec", timeToKeep="7 days", userId=user.uid)
+    db.add(app)
+    db.commit()
+    db.execute(insert(DbEndpoint), [{"relativeUrl": f"/{i}", "status": "Stable", "applicationId": app.uid} for i in range(endpoints)])
+    endpoint_ids = [endpoint.uid for endpoint in db.query(DbEndpoint.uid).filter(DbEndpoint.applicationId == app.uid)]
+    start = datetime.utcnow()
+    db.execute(insert(DbEndpointLog), [
+        {"endpointId": endpoint_id, "status": "200", "responseTime": 0.1 + i / 1000, "timestamp": start + timedelta(seconds=i)}
+        for endpoint_id in endpoint_ids for i in range(LOGS_PER_ENDPOINT)
+    ])
+    db.commit()
+    return app.uid
+
+
+def load(db, app_id: int):
+    db.expunge_all()
+    app = db.query(DbApplication).options(
+        joinedload(DbApplication.endpoints),
+        selectinload(DbApplication.ipInfo),
+        selectinload(DbApplication.bugs)
+    ).filter(DbApplication.uid == app_id).first()
+    endpoint_ids = [endpoint.uid for endpoint in app.endpoints]
+    logs = group_logs(endpoint_ids, db.scalars(latest_logs_query(endpoint_ids, LOGS_PER_ENDPOINT)))
+    for endpoint in app.endpoints:
+        set_committed_value(endpoint, "log", logs[endpoint.uid])
+    return app, logs
+
+
+def timed(func) -> float:
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    print(f"encoder: {'orjson' if orjson is not None else 'json'}")
+    print(f"{'endpoints':>9} {'logs':>7} {'pydantic ms':>12} {'documents ms':>13} {'snapshot json ms':>17} {'snapshot fast ms':>17}")
+    for endpoints in ENDPOINTS:
+        app, logs = load(db, seed(db, endpoints))
+        document = application_document(app, logs)
+        pydantic = timed(lambda: json.dumps(Application.model_validate(app).model_dump(mode="json")).encode())
+        fast = timed(lambda: dumps(application_document(app, logs)))
+        snapshot_json = timed(lambda: json.dumps(document))
+        snapshot_fast = timed(lambda: dumps(document).decode())
+        print(f"{endpoints:>9} {endpoints * LOGS_PER_ENDPOINT:>7} {pydantic:>12.2f} {fast:>13.2f} {snapshot_json:>17.2f} {snapshot_fast:>17.2f}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
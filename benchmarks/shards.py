@@ -0,0 +1,163 @@
+"""Several workers sharing the applications through shard leases.
+
+Run from the repository root:
+
+    python -m benchmarks.shards --workers 3 --apps 1000
+
+The applications are stored in a temporary SQLite file unless DB_PATH is
+set, then --workers processes run the shard manager and the scheduler
+against it, with a runner that only counts probe cycles. Once a second
+the shards and applications held by each worker are printed and checked:
+every shard must have exactly one owner, and every application must be
+scheduled by one worker. A quarter of the way through --new-apps more
+applications are created, as if through the API of any worker, and the
+time until their owners schedule them is reported. Halfway through one
+worker is killed without releasing its leases, and the time until the
+others have taken over its shards is reported.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DB_PATH", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "shards.db"))
+os.environ["SHARDING"] = "1"
+
+from sqlalchemy import insert
+from database.database import Base, engine, SessionLocal
+from database.models import DbApplication, DbUser
+from background.scheduler import scheduler
+from background.shards import shard_manager, sync_owned_apps
+
+
+def seed(run: str, start: int, apps: int):
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    user = db.query(DbUser).filter(DbUser.username == run).first()
+    if user is None:
+        user = DbUser(username=run, keyclockId=run)
+        db.add(user)
+        db.commit()
+    db.execute(insert(DbApplication), [
+        {"name": f"{run}-app-{i}", "status": "Stable", "baseUrl": "localhost", "refreshInterval": "1 sec", "timeToKeep": "7 days", "userId": user.uid}
+        for i in range(start, start + apps)
+    ])
+    db.commit()
+    db.close()
+
+
+async def worker(args):
+    """One worker: lease shards, schedule their apps and report once a second."""
+    cycles = 0
+
+    async def runner(app_id: int):
+        nonlocal cycles
+        cycles += 1
+
+    shard_manager.ttl = args.ttl
+    scheduler.accepts = shard_manager.owns
+    scheduler.start(runner)
+    while True:
+        await shard_manager.rebalance()
+        await sync_owned_apps()
+        print(json.dumps({
+            "worker": shard_manager.worker_id,
+            "owned": sorted(shard_manager.owned),
+            "apps": len(scheduler.scheduled_apps()),
+            "cycles": cycles,
+        }), flush=True)
+        await asyncio.sleep(args.heartbeat)
+
+
+async def read_reports(process, states: dict, index: int):
+    while True:
+        line = await process.stdout.readline()
+        if not line:
+            return
+        states[index] = json.loads(line)
+
+
+def coverage(states: dict, alive) -> (int, int):
+    """Shards owned by a live worker, and shards claimed by more than one."""
+    owners = {}
+    for index in alive:
+        for shard in states.get(index, {}).get("owned", []):
+            owners[shard] = owners.get(shard, 0) + 1
+    return len(owners), sum(1 for count in owners.values() if count > 1)
+
+
+async def run(args):
+    run_id = f"shards-{int(time.time())}"
+    seed(run_id, 0, args.apps)
+    total = args.apps
+    processes = [
+        await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "benchmarks.shards", "--worker", "--ttl", str(args.ttl), "--heartbeat", str(args.heartbeat),
+            env={**os.environ, "WORKER_ID": f"worker-{i}"},
+            stdout=asyncio.subprocess.PIPE,
+        )
+        for i in range(args.workers)
+    ]
+    states = {}
+    readers = [asyncio.create_task(read_reports(process, states, i)) for i, process in enumerate(processes)]
+    alive = set(range(args.workers))
+    killed_at = None
+    recovered = None
+    created_at = None
+    picked_up = None
+    start = time.monotonic()
+    try:
+        while time.monotonic() - start < args.duration:
+            await asyncio.sleep(1)
+            elapsed = time.monotonic() - start
+            if created_at is None and elapsed >= args.duration / 4 and args.new_apps:
+                seed(run_id, total, args.new_apps)
+                total += args.new_apps
+                created_at = elapsed
+                print(f"{elapsed:6.1f}s created {args.new_apps} apps")
+            if killed_at is None and elapsed >= args.duration / 2 and args.workers > 1:
+                victim = args.workers - 1
+                processes[victim].send_signal(signal.SIGKILL)
+                alive.discard(victim)
+                killed_at = elapsed
+                print(f"{elapsed:6.1f}s killed worker-{victim}")
+            covered, overlapping = coverage(states, alive)
+            scheduled = sum(states.get(i, {}).get("apps", 0) for i in alive)
+            if created_at is not None and picked_up is None and scheduled == total:
+                picked_up = elapsed - created_at
+            if killed_at is not None and recovered is None and covered == shard_manager.shard_count:
+                recovered = elapsed - killed_at
+            held = "  ".join(f"worker-{i}: {len(states.get(i, {}).get('owned', []))} shards {states.get(i, {}).get('apps', 0)} apps" for i in sorted(alive))
+            print(f"{elapsed:6.1f}s covered {covered}/{shard_manager.shard_count} overlapping {overlapping} scheduled {scheduled}/{total}  {held}")
+    finally:
+        for i in alive:
+            processes[i].terminate()
+        for process in processes:
+            await process.wait()
+        for reader in readers:
+            reader.cancel()
+    if created_at is not None:
+        print(f"new apps scheduled after: {'%.1fs' % picked_up if picked_up is not None else 'not within the run'}")
+    if killed_at is not None:
+        print(f"takeover after the kill: {'%.1fs' % recovered if recovered is not None else 'not within the run'}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--apps", type=int, default=1000)
+    parser.add_argument("--new-apps", type=int, default=100, help="applications created once the workers run")
+    parser.add_argument("--duration", type=float, default=40.0, help="seconds the workers run")
+    parser.add_argument("--ttl", type=float, default=6.0, help="seconds a lease lasts without renewal")
+    parser.add_argument("--heartbeat", type=float, default=1.0, help="seconds between lease renewals")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(worker(args) if args.worker else run(args))
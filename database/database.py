@@ -1,18 +1,221 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from contextlib import contextmanager, asynccontextmanager
 import os
-from internal.admin import DB_PATH
+import time
+from internal.metrics import db_query_duration, current_route
+from internal.admin import DB_PATH, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, SQLITE_BUSY_TIMEOUT
 
-engine = create_engine(DB_PATH)
+# Async drivers used for the same database by the async engine
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    return ASYNC_DRIVERS.get(scheme, scheme) + "://" + rest
+
+
+class CheckoutStats:
+    """Time spent waiting for a connection from a pool."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    def record(self, wait: float):
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.last_wait = wait
+
+    def stats(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "lastWait": self.last_wait,
+            "maxWait": self.max_wait,
+            "meanWait": self.total_wait / self.checkouts if self.checkouts else 0.0,
+        }
+
+
+class SessionStats:
+    """Objects held in the identity map of sessions when they are closed."""
+
+    def __init__(self):
+        self.open = 0
+        self.closed = 0
+        self.total_size = 0
+        self.max_size = 0
+        self.last_size = 0
+
+    def opened(self):
+        self.open += 1
+
+    def record(self, size: int):
+        self.open -= 1
+        self.closed += 1
+        self.total_size += size
+        self.max_size = max(self.max_size, size)
+        self.last_size = size
+
+    def stats(self) -> dict:
+        return {
+            "open": self.open,
+            "closed": self.closed,
+            "lastSize": self.last_size,
+            "maxSize": self.max_size,
+            "meanSize": self.total_size / self.closed if self.closed else 0.0,
+        }
+
+
+class TimedPool:
+    """Records how long each checkout waited for a free connection."""
+
+    checkout_stats: CheckoutStats
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.checkout_stats.record(time.perf_counter() - start)
+
+
+class TimedQueuePool(TimedPool, QueuePool):
+    checkout_stats = CheckoutStats()
+
+
+class TimedAsyncQueuePool(TimedPool, AsyncAdaptedQueuePool):
+    checkout_stats = CheckoutStats()
+
+
+def engine_options(url: str, poolclass) -> dict:
+    """Pool settings for a database, in-memory SQLite keeps its single connection pool."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def tune_sqlite(dbapi_connection, connection_record):
+    # WAL lets the probe writer commit while readers keep going, NORMAL only
+    # syncs at checkpoints, which is safe with WAL. Foreign keys are off by
+    # default, without them bulk deletes skip the ON DELETE CASCADE of the
+    # models and leave logs, stats and outages behind
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.close()
+
+
+engine = create_engine(DB_PATH, **engine_options(DB_PATH, TimedQueuePool))
+async_engine = create_async_engine(async_url(DB_PATH), **engine_options(DB_PATH, TimedAsyncQueuePool))
+
+def query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+def query_finished(conn, cursor, statement, parameters, context, executemany):
+    # Attributed to the route of the request that ran the query, or to
+    # "background" for the scheduler, writer and compaction jobs
+    db_query_duration.observe(time.perf_counter() - conn.info["query_start"], current_route())
+
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", tune_sqlite)
+    event.listen(async_engine.sync_engine, "connect", tune_sqlite)
+
+for sync_engine in (engine, async_engine.sync_engine):
+    event.listen(sync_engine, "before_cursor_execute", query_started)
+    event.listen(sync_engine, "after_cursor_execute", query_finished)
 
 SessionLocal = sessionmaker(autocommit = False, autoflush = False, bind = engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush = False, expire_on_commit = False)
+
+session_stats = SessionStats()
 
 Base = declarative_base()
 
+
+def _closed(db) -> None:
+    session_stats.record(len(db.identity_map))
+
+
+# One short-lived session per unit of work of the background jobs,
+# committed when the block succeeds and rolled back otherwise
+@contextmanager
+def session_scope():
+    db = SessionLocal()
+    session_stats.opened()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        _closed(db)
+        db.close()
+
+@asynccontextmanager
+async def async_session_scope():
+    db = AsyncSessionLocal()
+    session_stats.opened()
+    try:
+        yield db
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    finally:
+        _closed(db)
+        await db.close()
+
+
 def get_db():
     db = SessionLocal()
+    session_stats.opened()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        _closed(db)
+        db.close()
+
+async def get_async_db():
+    db = AsyncSessionLocal()
+    session_stats.opened()
+    try:
+        yield db
+    finally:
+        _closed(db)
+        await db.close()
+
+
+def database_stats() -> dict:
+    def pool_stats(pool) -> dict:
+        stats = {"status": pool.status()}
+        if isinstance(pool, TimedPool):
+            stats.update(size=pool.size(), checkedOut=pool.checkedout(), overflow=pool.overflow(), **pool.checkout_stats.stats())
+        return stats
+
+    return {
+        "pool": pool_stats(engine.pool),
+        "asyncPool": pool_stats(async_engine.pool),
+        "sessions": session_stats.stats(),
+    }
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float
+from sqlalchemy import event, inspect, text, Column, Integer, String, ForeignKey, DateTime, Float, UniqueConstraint, Index
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.orm import relationship
 from database.database import Base
 from datetime import datetime
@@ -36,6 +37,7 @@ class DbIpInfo(Base):
     
 class DbEndpointLog(Base):
     __tablename__ = "endpointLog"
+    __table_args__ = (Index('ix_endpointLog_endpointId_timestamp', 'endpointId', 'timestamp'),)
     uid = Column(Integer, primary_key=True, index=True)
     responseTime = Column(Float)
     status = Column(String)
@@ -73,6 +75,105 @@ class DbEndpoint(Base):
     status = Column(String)
     
     log = relationship("DbEndpointLog", back_populates="endpoint", cascade="all, delete")
+    stats = relationship("DbEndpointStats", back_populates="endpoint", uselist=False, cascade="all, delete")
     
     applicationId = Column(Integer, ForeignKey('application.uid', ondelete='CASCADE'))
     application = relationship("DbApplication", back_populates="endpoints", cascade="all, delete")
+
+
+
+# Rolling state of an endpoint, updated each time a log is written
+class DbEndpointStats(Base):
+    __tablename__ = "endpointStats"
+    endpointId = Column(Integer, ForeignKey('endpoint.uid', ondelete='CASCADE'), primary_key=True)
+    recentStatuses = Column(String, default="")
+    stableCount = Column(Integer, default=0)
+    unstableCount = Column(Integer, default=0)
+    downCount = Column(Integer, default=0)
+    lastProbe = Column(DateTime)
+    
+    endpoint = relationship("DbEndpoint", back_populates="stats")
+
+
+# Per-minute downsampling of endpointLog, statuses is a JSON histogram and
+# latencies the JSON counts of successful probes per HISTOGRAM_BOUNDS bin
+class DbEndpointLogMinute(Base):
+    __tablename__ = "endpointLogMinute"
+    __table_args__ = (UniqueConstraint('endpointId', 'bucket'),)
+    uid = Column(Integer, primary_key=True, index=True)
+    bucket = Column(DateTime)
+    count = Column(Integer)
+    statuses = Column(String)
+    latencies = Column(String, nullable=True)
+    minResponseTime = Column(Float)
+    maxResponseTime = Column(Float)
+    meanResponseTime = Column(Float)
+    
+    endpointId = Column(Integer, ForeignKey('endpoint.uid', ondelete='CASCADE'))
+
+
+# Per-hour downsampling of endpointLogMinute
+class DbEndpointLogHour(Base):
+    __tablename__ = "endpointLogHour"
+    __table_args__ = (UniqueConstraint('endpointId', 'bucket'),)
+    uid = Column(Integer, primary_key=True, index=True)
+    bucket = Column(DateTime)
+    count = Column(Integer)
+    statuses = Column(String)
+    latencies = Column(String, nullable=True)
+    minResponseTime = Column(Float)
+    maxResponseTime = Column(Float)
+    meanResponseTime = Column(Float)
+    
+    endpointId = Column(Integer, ForeignKey('endpoint.uid', ondelete='CASCADE'))
+
+
+# A period during which an endpoint failed its probes, end is NULL while open
+class DbOutage(Base):
+    __tablename__ = "outage"
+    __table_args__ = (Index('ix_outage_endpointId_start', 'endpointId', 'start'),)
+    uid = Column(Integer, primary_key=True, index=True)
+    start = Column(DateTime)
+    end = Column(DateTime, nullable=True)
+    
+    endpointId = Column(Integer, ForeignKey('endpoint.uid', ondelete='CASCADE'))
+
+
+# A process monitoring applications in sharding mode, alive while its
+# heartbeat is recent
+class DbWorker(Base):
+    __tablename__ = "worker"
+    id = Column(String, primary_key=True)
+    heartbeat = Column(DateTime)
+
+
+# Ownership of the applications whose uid falls in a shard, owner is NULL
+# once released and the lease is free again after expires
+class DbShardLease(Base):
+    __tablename__ = "shardLease"
+    shard = Column(Integer, primary_key=True, autoincrement=False)
+    owner = Column(String, nullable=True)
+    expires = Column(DateTime, nullable=True)
+
+
+# create_all skips the indexes of tables that already exist, so indexes
+# added to an existing table are created here
+def create_missing_indexes(target, connection, **kw):
+    for table in target.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+# Likewise for columns, only nullable ones can be added to existing rows
+def create_missing_columns(target, connection, **kw):
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    for table in target.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                connection.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {CreateColumn(column).compile(dialect=connection.dialect)}"))
+
+
+event.listen(Base.metadata, "after_create", create_missing_columns)
+event.listen(Base.metadata, "after_create", create_missing_indexes)
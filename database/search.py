@@ -0,0 +1,99 @@
+from sqlalchemy import event, func, or_, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+from database.database import Base
+from database.models import DbApplication
+
+# Shortest query the trigram indexes can answer, shorter ones scan the table
+MIN_TRIGRAM_QUERY = 3
+# Matches ranked per FTS5 query, so a query matching most apps stays cheap
+SEARCH_CANDIDATES = 1000
+
+# SQLite keeps an FTS5 trigram index over the application table, synced by
+# triggers. Postgres indexes lower(name) and lower(baseUrl) with pg_trgm.
+SQLITE_SEARCH_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS "applicationSearch" USING fts5(
+        name, "baseUrl", content='application', content_rowid='uid', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS "applicationSearch_insert" AFTER INSERT ON application BEGIN
+        INSERT INTO "applicationSearch"(rowid, name, "baseUrl") VALUES (new.uid, new.name, new."baseUrl");
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS "applicationSearch_delete" AFTER DELETE ON application BEGIN
+        INSERT INTO "applicationSearch"("applicationSearch", rowid, name, "baseUrl") VALUES ('delete', old.uid, old.name, old."baseUrl");
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS "applicationSearch_update" AFTER UPDATE OF name, "baseUrl" ON application BEGIN
+        INSERT INTO "applicationSearch"("applicationSearch", rowid, name, "baseUrl") VALUES ('delete', old.uid, old.name, old."baseUrl");
+        INSERT INTO "applicationSearch"(rowid, name, "baseUrl") VALUES (new.uid, new.name, new."baseUrl");
+    END""",
+)
+POSTGRES_SEARCH_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    'CREATE INDEX IF NOT EXISTS "ix_application_name_trgm" ON application USING gin (lower(name) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS "ix_application_baseUrl_trgm" ON application USING gin (lower("baseUrl") gin_trgm_ops)',
+)
+
+# Index in use for this process, set once the tables are created
+search_backend = "like"
+
+
+def install_search(target, connection, **kw):
+    """Create the search index after create_all, falling back to LIKE scans."""
+    global search_backend
+    dialect = connection.dialect.name
+    try:
+        with connection.begin_nested():
+            if dialect == "sqlite":
+                exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'applicationSearch'")).first()
+                for statement in SQLITE_SEARCH_DDL:
+                    connection.execute(text(statement))
+                if not exists:
+                    # Index the applications stored before the search table
+                    connection.execute(text("""INSERT INTO "applicationSearch"("applicationSearch") VALUES ('rebuild')"""))
+                search_backend = "fts5"
+            elif dialect == "postgresql":
+                for statement in POSTGRES_SEARCH_DDL:
+                    connection.execute(text(statement))
+                search_backend = "trigram"
+    except DBAPIError as e:
+        print(f"Search index unavailable, searching with LIKE: {e}")
+        search_backend = "like"
+
+
+event.listen(Base.metadata, "after_create", install_search)
+
+
+def _like_pattern(query: str) -> str:
+    return query.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def search_applications(query: str, limit: int, db: AsyncSession) -> List[int]:
+    """Uids of the applications whose name or baseUrl contains query, best match first.
+
+    Names starting with the query rank first, then by the index's own
+    relevance: bm25 for FTS5, trigram similarity for Postgres. FTS5 ranks
+    the first SEARCH_CANDIDATES matches only.
+    """
+    pattern = _like_pattern(query)
+    prefix = func.lower(DbApplication.name).like(pattern + "%", escape="\\")
+
+    if search_backend == "fts5" and len(query) >= MIN_TRIGRAM_QUERY:
+        rows = await db.execute(
+            text("""SELECT rowid FROM (
+                        SELECT rowid, name, rank FROM "applicationSearch" WHERE "applicationSearch" MATCH :match LIMIT :candidates
+                    ) ORDER BY lower(name) LIKE :prefix ESCAPE '\\' DESC, rank LIMIT :limit"""),
+            {"match": '"' + query.replace('"', '""') + '"', "prefix": pattern + "%", "candidates": SEARCH_CANDIDATES, "limit": limit}
+        )
+        return [row[0] for row in rows]
+
+    contains = or_(
+        func.lower(DbApplication.name).like("%" + pattern + "%", escape="\\"),
+        func.lower(DbApplication.baseUrl).like("%" + pattern + "%", escape="\\"),
+    )
+    statement = select(DbApplication.uid).where(contains)
+    if search_backend == "trigram":
+        similarity = func.greatest(func.similarity(func.lower(DbApplication.name), query.lower()), func.similarity(func.lower(DbApplication.baseUrl), query.lower()))
+        statement = statement.order_by(prefix.desc(), similarity.desc(), DbApplication.uid)
+    else:
+        statement = statement.order_by(prefix.desc(), func.length(DbApplication.name), DbApplication.uid)
+    return list((await db.execute(statement.limit(limit))).scalars())
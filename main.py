@@ -2,15 +2,28 @@ from fastapi import FastAPI, Depends, BackgroundTasks, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from database.database import engine, get_db
 from database.models import DbApplication 
-from routers import application, user, bug, ws
+from routers import application, user, bug, ws, analytics, metrics
+from routers.metrics import MetricsMiddleware, ProfilingMiddleware
+from internal.admin import PROFILE_REQUESTS
 from auth.auth import get_user_info
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from routers.application import start_monitoring
+from background.backgroundTasks import startup_event, shutdown_event
+from contextlib import asynccontextmanager
+from routers.serialization import FastJSONResponse
 import httpx
 import asyncio
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup_event()
+    yield
+    await shutdown_event()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,11 +32,16 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"]
 )
+app.add_middleware(MetricsMiddleware)
+if PROFILE_REQUESTS:
+    app.add_middleware(ProfilingMiddleware)
 
 app.include_router(user.router)
 app.include_router(application.router)
 app.include_router(bug.router)
 app.include_router(ws.router)
+app.include_router(analytics.router)
+app.include_router(metrics.router)
 
 @app.get("/")
 def route():
@@ -0,0 +1,183 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from database.database import get_db
+from database.models import DbApplication, DbEndpoint, DbEndpointLog, DbEndpointLogMinute, DbEndpointLogHour
+from routers.schemas import LatencyReport
+from routers.utils import OK_STATUSES, HISTOGRAM_BOUNDS
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+import json
+import numpy as np
+
+router = APIRouter(
+    prefix="/analytics",
+    tags=["Analytics"]
+)
+
+PERCENTILES = (50, 90, 95, 99)
+MAX_BUCKETS = 2000
+# Rollup tiers read for the part of a window the raw logs no longer cover,
+# with the time each of their rows spans
+ROLLUP_TIERS = ((DbEndpointLogMinute, timedelta(minutes=1)), (DbEndpointLogHour, timedelta(hours=1)))
+BIN_COUNT = len(HISTOGRAM_BOUNDS) + 1
+
+
+def _percentiles(values: np.ndarray) -> dict:
+    if values.size == 0:
+        return {f"p{p}": None for p in PERCENTILES}
+    return {f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+def _histogram_percentiles(bins: np.ndarray) -> dict:
+    """Percentiles interpolated linearly within the histogram bins.
+
+    Values in the unbounded last bin are reported as its lower bound.
+    """
+    total = bins.sum()
+    if total == 0:
+        return {f"p{p}": None for p in PERCENTILES}
+    cumulative = np.cumsum(bins)
+    lowers = (0.0,) + HISTOGRAM_BOUNDS
+    result = {}
+    for p in PERCENTILES:
+        rank = p / 100 * total
+        index = min(int(np.searchsorted(cumulative, rank)), BIN_COUNT - 1)
+        if index == BIN_COUNT - 1:
+            result[f"p{p}"] = HISTOGRAM_BOUNDS[-1]
+            continue
+        below = cumulative[index] - bins[index]
+        fraction = (rank - below) / bins[index] if bins[index] else 0.0
+        result[f"p{p}"] = float(lowers[index] + fraction * (HISTOGRAM_BOUNDS[index] - lowers[index]))
+    return result
+
+
+class _Bucket:
+    def __init__(self):
+        self.count = 0
+        self.ok = 0
+        self.bins = np.zeros(BIN_COUNT, dtype=int)
+        self.latencies = []
+        self.estimated = False
+
+    def add(self, other: "_Bucket"):
+        self.count += other.count
+        self.ok += other.ok
+        self.bins += other.bins
+        self.latencies.extend(other.latencies)
+        self.estimated = self.estimated or other.estimated
+
+    def report(self) -> dict:
+        if self.estimated:
+            percentiles = _histogram_percentiles(self.bins)
+        else:
+            percentiles = _percentiles(np.concatenate(self.latencies) if self.latencies else np.empty(0))
+        return {
+            "count": self.count,
+            "errorRate": 1 - self.ok / self.count if self.count else 0.0,
+            "percentiles": percentiles,
+            "estimated": self.estimated,
+        }
+
+
+def latency_report(endpoint_ids, since: datetime, until: datetime, bucket: int, db: Session) -> dict:
+    """Latency percentiles, histogram and error rate of the probes of a window.
+
+    Recent probes are read from the raw logs, pulled as columns in one
+    query, and older ones from the minute and hour rollups. Compaction
+    moves each probe to exactly one of them, so they add up. Percentiles
+    over rollups are interpolated from their histogram bins and flagged
+    estimated, and rollups only count toward the bucket holding their
+    start. Latency figures only count successful probes, failed ones have
+    no response time.
+    """
+    buckets = defaultdict(_Bucket)
+
+    rows = db.execute(
+        select(DbEndpointLog.timestamp, DbEndpointLog.responseTime, DbEndpointLog.status).where(
+            DbEndpointLog.endpointId.in_(endpoint_ids),
+            DbEndpointLog.timestamp >= since,
+            DbEndpointLog.timestamp < until
+        )
+    ).all()
+    if rows:
+        timestamps, response_times, statuses = zip(*rows)
+        offsets = (np.array(timestamps, dtype="datetime64[us]") - np.datetime64(since, "us")) / np.timedelta64(1, "s")
+        latencies = np.array([value or 0.0 for value in response_times], dtype=float)
+        ok = np.isin(np.array(statuses, dtype=object), OK_STATUSES)
+        bins = np.searchsorted(HISTOGRAM_BOUNDS, latencies, side="left")
+
+        bucket_index = (offsets // bucket).astype(int)
+        order = np.argsort(bucket_index, kind="stable")
+        bucket_index, latencies, ok, bins = bucket_index[order], latencies[order], ok[order], bins[order]
+        starts = np.flatnonzero(np.r_[True, bucket_index[1:] != bucket_index[:-1]])
+        for begin, end in zip(starts, np.r_[starts[1:], bucket_index.size]):
+            entry = buckets[int(bucket_index[begin])]
+            bucket_ok = ok[begin:end]
+            entry.count += int(end - begin)
+            entry.ok += int(bucket_ok.sum())
+            entry.bins += np.bincount(bins[begin:end][bucket_ok], minlength=BIN_COUNT)
+            entry.latencies.append(latencies[begin:end][bucket_ok])
+
+    for model, span in ROLLUP_TIERS:
+        rollups = db.execute(
+            select(model.bucket, model.count, model.statuses, model.latencies).where(
+                model.endpointId.in_(endpoint_ids),
+                model.bucket > since - span,
+                model.bucket < until
+            )
+        ).all()
+        for start, count, statuses, latencies in rollups:
+            entry = buckets[max(int((start - since).total_seconds() // bucket), 0)]
+            statuses = json.loads(statuses or "{}")
+            entry.count += count or 0
+            entry.ok += sum(statuses.get(status, 0) for status in OK_STATUSES)
+            if latencies:
+                entry.bins += np.array(json.loads(latencies), dtype=int)
+            entry.estimated = True
+
+    total = _Bucket()
+    for entry in buckets.values():
+        total.add(entry)
+
+    return {
+        "since": since,
+        "until": until,
+        "bucket": bucket,
+        **total.report(),
+        "histogram": [{"le": le, "count": int(count)} for le, count in zip(HISTOGRAM_BOUNDS + (None,), total.bins)],
+        "buckets": [
+            {"start": since + timedelta(seconds=index * bucket), **buckets[index].report()}
+            for index in sorted(buckets)
+        ],
+    }
+
+
+def _window(since: Optional[datetime], until: Optional[datetime], bucket: int):
+    until = until or datetime.utcnow()
+    since = since or until - timedelta(hours=1)
+    if bucket <= 0 or since >= until:
+        raise HTTPException(status_code=400, detail="Invalid window")
+    if (until - since).total_seconds() / bucket > MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Window holds more than {MAX_BUCKETS} buckets")
+    return since, until
+
+
+# Latency analytics of a particular endpoint
+@router.get("/endpoint/{id}")
+def get_endpoint_analytics(id: int, since: Optional[datetime] = None, until: Optional[datetime] = None, bucket: int = 60, db: Session = Depends(get_db)) -> LatencyReport:
+    if db.get(DbEndpoint, id) is None:
+        raise HTTPException(status_code=400, detail="Endpoint with this id does not exist")
+    since, until = _window(since, until, bucket)
+    return latency_report([id], since, until, bucket, db)
+
+
+# Latency analytics over all endpoints of an application
+@router.get("/application/{id}")
+def get_application_analytics(id: int, since: Optional[datetime] = None, until: Optional[datetime] = None, bucket: int = 60, db: Session = Depends(get_db)) -> LatencyReport:
+    if db.get(DbApplication, id) is None:
+        raise HTTPException(status_code=400, detail="App with this id does not exist")
+    since, until = _window(since, until, bucket)
+    endpoint_ids = select(DbEndpoint.uid).where(DbEndpoint.applicationId == id)
+    return latency_report(endpoint_ids, since, until, bucket, db)
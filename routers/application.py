@@ -1,21 +1,44 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, WebSocket
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, WebSocket, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from routers.schemas import Application, UserProfile, Endpoint
-from database.database import get_db
-from database.models import DbApplication, DbEndpoint, DbIpInfo, DbUser, DbEndpointLog
-from typing import List
+from routers.schemas import Application, UserProfile, Endpoint, EndpointRollup, EndpointLogPage, ApplicationSummary, ApplicationSummaryPage, BulkImportError, BulkImportResult, ApplicationPatch
+from database.database import get_db, get_async_db, async_session_scope, database_stats
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import DbApplication, DbEndpoint, DbIpInfo, DbUser, DbEndpointLog, DbBug, DbEndpointLogMinute, DbEndpointLogHour, DbEndpointStats
+from typing import List, Optional
 import asyncio
 import time 
-import requests
-import socket
+import httpx
 from auth.auth import get_payload
 from datetime import datetime, timedelta
-from sqlalchemy import and_, or_, func
-from sqlalchemy.orm import joinedload
+from sqlalchemy import and_, or_, func, delete, insert, select, update, Select
+from sqlalchemy.exc import IntegrityError
+from collections import Counter
+from sqlalchemy.orm import joinedload, selectinload
 import json
-from routers.utils import get_endpoint_status_ratio, determine_stability, calculate_downtime_minutes, time_to_seconds
+import csv
+import io
+from background.probe import probe_engine, endpoint_url, base_host
+from background.resolver import resolver
+from background.shards import shard_manager, update_relay
+from database.search import search_applications
+from routers.serialization import FastJSONResponse, application_document, log_document, dumps_text
+from background.scheduler import scheduler, schedule_applications
+from background.writer import probe_writer, AppProbeResult, ProbeResult
+from routers.utils import OK_STATUSES, get_endpoint_status_ratio, time_to_seconds, latest_logs_query, group_logs, application_loaders, encode_log_cursor, decode_log_cursor, encode_app_cursor, decode_app_cursor
+from internal.metrics import probe_duration, probe_results
+from internal.admin import LOG_SLICE, LOG_PAGE_SIZE, LOG_PAGE_MAX, EXPORT_CHUNK_SIZE, APP_PAGE_SIZE, APP_PAGE_MAX, BULK_IMPORT_MAX
 from datetime import datetime, timedelta
 
+# Content types of a bulk import sent as one JSON object per line
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson")
+
+ROLLUP_MODELS = {
+    "minute": DbEndpointLogMinute,
+    "hour": DbEndpointLogHour,
+}
+
 router = APIRouter(
     prefix="/application",
     tags=["Application"]
@@ -23,114 +46,108 @@ router = APIRouter(
             
 
 
-def get_endpoint_ip(url: str) -> str:
+async def get_endpoint_ip(url: str) -> str:
     try:
-        print(f"{url}")
-        ip_address = socket.gethostbyname(url)
-        return ip_address
-    except socket.gaierror:
-        return "IP not found"
+        address = await resolver.resolve(base_host(url))
+    except httpx.InvalidURL:
+        address = None
+    return address or "IP not found"
 
 
 
-async def monitor_endpoints(app_id: int, refresh_interval: int, time_to_keep: int, db: Session):
-    while True:
-        try:
-            await asyncio.sleep(refresh_interval)
-            app = db.query(DbApplication).filter(DbApplication.uid == app_id).first()
-            if app:
-                endpoint_statuses = []
-                
-                for endpoint in app.endpoints:
-                    status = 200  
-                    relativeUrl = endpoint.relativeUrl
-                    if relativeUrl[0] == '/':
-                        relativeUrl = relativeUrl[1:]
-                    path = "https://" + app.baseUrl + "/" + relativeUrl
-                    response_time = .001
-                    try:
-                        response = requests.get(path)
-                        response.raise_for_status()
-                        response_time = response.elapsed.total_seconds()
-                        status = response.status_code
-                    except requests.RequestException as e:
-                        response_time = 0
-                        status = 500  
-                    
-                    log = DbEndpointLog(
-                        responseTime=response_time,
-                        status=status,
-                        endpointId=endpoint.uid,
-                    )
-                    db.add(log)
-                    
-                    endpoint_statuses.append(status)
-                    # Determine the stability of each endpoint 
-                    endpoint.status = determine_stability(endpoint.uid, db)
-                # The app is stable if 
-                app.status = "Stable" if all(endpoint.status == "Stable" for endpoint in app.endpoints) else "Unstable" if any(endpoint.status in ["Unstable"] for endpoint in app.endpoints) else "Down"
-                if app.bugs and app.status == "Unstable":
-                    app.status = "Down"
-                else:
-                    app.status = "Unstable"
-                db.add(app)
-                db.commit()
-                db.refresh(app)
-                
-                # Delete old logs
-                oldest_allowed_time = current_time - timedelta(seconds=time_to_keep)
-                db.query(DbEndpointLog).filter(
-                    DbEndpointLog.timestamp < oldest_allowed_time,
-                    DbEndpointLog.endpointId.in_([ep.uid for ep in app.endpoints])
-                ).delete()
-                db.commit()
-            else:
-                print(f"App does not exist")
-                break
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            # If an error occurs, set application status to Down
-            if app:
-                app.status = "Down"
-                db.add(app)
-                db.commit()
-                db.refresh(app)
-            continue
+async def monitor_endpoints(app_id: int):
+    """Run one probe cycle for an application, called by the scheduler.
 
+    The results are handed to the probe writer, which stores the logs and
+    the new endpoint and application statuses.
+    """
+    async with async_session_scope() as db:
+        app = (await db.execute(select(DbApplication.uid, DbApplication.baseUrl).where(DbApplication.uid == app_id))).first()
+        if app is None:
+            print(f"App does not exist")
+            scheduler.cancel(app_id)
+            return
+        endpoints = (await db.execute(select(DbEndpoint.uid, DbEndpoint.relativeUrl).where(DbEndpoint.applicationId == app_id))).all()
+        has_bugs = (await db.execute(select(DbBug.uid).where(DbBug.applicationId == app_id).limit(1))).first() is not None
 
+    urls = [endpoint_url(app.baseUrl, endpoint.relativeUrl) for endpoint in endpoints]
+    results = await probe_engine.probe_many(urls)
+    probed_at = datetime.utcnow()
+    healthy = True
+    for status, response_time in results:
+        probe_results.inc(app_id, status)
+        if status in OK_STATUSES:
+            probe_duration.observe(response_time, app_id)
+        else:
+            healthy = False
+    scheduler.report(app_id, healthy)
 
+    await probe_writer.submit(AppProbeResult(
+        appId=app_id,
+        hasBugs=has_bugs,
+        results=[
+            ProbeResult(endpointId=endpoint.uid, status=status, responseTime=response_time, timestamp=probed_at)
+            for endpoint, (status, response_time) in zip(endpoints, results)
+        ]
+    ))
 
-async def monitor_and_start(app_id: int, refresh_interval: int, time_to_keep: int, db: Session):
-    await monitor_endpoints(app_id, refresh_interval, time_to_keep, db)
 
-# Endpoint to start monitoring all endpoints
+# Endpoint to (re)load every application into the scheduler
 @router.post("/start")
-async def start_monitoring(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    applications = db.query(DbApplication).all()
-    tasks = []
-    for app in applications:
-        print(f"{app.name} started")
-        task = monitor_and_start(
-            app_id=app.uid,
-            refresh_interval=time_to_seconds(app.refreshInterval),
-            time_to_keep=time_to_seconds(app.timeToKeep),
-            db=db
-        )
-        tasks.append(task)
-    await asyncio.gather(*tasks)
+async def start_monitoring(db: AsyncSession = Depends(get_async_db)):
+    await schedule_applications(db)
     return {"message": "Monitoring started for all applications."}
 
-        
+
+# Scheduling lag and load of the monitor
+@router.get("/scheduler/stats")
+def get_scheduler_stats():
+    return scheduler.stats()
+
+
+# Queue depth and throughput of the probe writer
+@router.get("/writer/stats")
+def get_writer_stats():
+    return probe_writer.stats()
+
+
+# Requests sent and probes answered by a shared request
+@router.get("/probe/stats")
+def get_probe_stats():
+    return probe_engine.stats()
+
+
+# Shards leased by this worker and WebSocket updates relayed from others
+@router.get("/shards/stats")
+def get_shard_stats():
+    return {**shard_manager.stats(), "relay": update_relay.stats()}
+
+
+# Cache hits and failed lookups of the DNS resolver
+@router.get("/resolver/stats")
+def get_resolver_stats():
+    return resolver.stats()
+
+
+# Connection pool waits and session sizes
+@router.get("/database/stats")
+def get_database_stats():
+    return database_stats()
 
 
 # Add application
 @router.post("/")
-async def add_application(item: Application, background_tasks: BackgroundTasks, db: Session = Depends(get_db), payload = Depends(get_payload)) -> Application:
-    existing_app = db.query(DbApplication).filter(DbApplication.name == item.name).first()
-    user = db.query(DbUser).filter(DbUser.keyclockId == payload.get("sub")).first()
+async def add_application(item: Application, db: AsyncSession = Depends(get_async_db), payload = Depends(get_payload)) -> Application:
+    existing_app = (await db.execute(select(DbApplication.uid).where(DbApplication.name == item.name))).first()
+    user = (await db.execute(select(DbUser).where(DbUser.keyclockId == payload.get("sub")))).scalars().first()
     if existing_app:
         raise HTTPException(status_code=400, detail="An application with the same name already exists")
+    try:
+        interval = time_to_seconds(item.refreshInterval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"refreshInterval: {e}")
 
+    address = await get_endpoint_ip(item.baseUrl)
     app = DbApplication(
         name=item.name,
         status="Stable",
@@ -139,9 +156,8 @@ async def add_application(item: Application, background_tasks: BackgroundTasks,
         timeToKeep = item.timeToKeep,
         userId = user.uid
     )
-    
     db.add(app)
-    db.commit()
+    await db.flush()
     
     for endpoint_data in item.endpoints:
         endpoint = DbEndpoint(
@@ -150,51 +166,378 @@ async def add_application(item: Application, background_tasks: BackgroundTasks,
             applicationId=app.uid
         )
         db.add(endpoint)
-    db.commit()
     
     info = DbIpInfo(
-        address=get_endpoint_ip(app.baseUrl),
+        address=address,
         location="Romania",
         timezone="Bucharest",
         applicationId=app.uid
     )
     db.add(info)
-    db.commit()
+    await db.commit()
     
-    db.refresh(app)
+    app = (await db.execute(
+        select(DbApplication).options(*application_loaders()).where(DbApplication.uid == app.uid).execution_options(populate_existing=True)
+    )).scalars().first()
     
-    background_tasks.add_task(monitor_endpoints, app_id=app.uid, refresh_interval=time_to_seconds(app.refreshInterval), time_to_keep=time_to_seconds(app.timeToKeep), db=db)
+    scheduler.schedule(app.uid, interval, app.baseUrl)
     
     return app
 
-# Fetch all applications
-@router.get("/all")
-async def get_all_applications(db: Session = Depends(get_db)) -> List[Application]:
-    applications = db.query(DbApplication)
-    return applications
+# Columns of the summary read straight from the application table, the
+# other fields are aggregated from its endpoints
+SUMMARY_COLUMNS = {
+    "name": DbApplication.name,
+    "status": DbApplication.status,
+    "baseUrl": DbApplication.baseUrl,
+}
+SUMMARY_FIELDS = set(SUMMARY_COLUMNS) | {"endpointCount", "endpointStatuses", "lastProbe"}
+
+
+def summary_fields(fields: Optional[str]) -> set:
+    if fields is None:
+        return SUMMARY_FIELDS
+    selected = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = selected - SUMMARY_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return selected
+
+
+async def summarize(rows, selected: set, db: AsyncSession) -> List[dict]:
+    """Summary documents of the applications in rows, with the selected aggregates added.
+
+    Only the selected fields are present, the documents are sent as is.
+    """
+    summaries = {row.uid: dict(row._mapping) for row in rows}
+    app_ids = list(summaries)
 
+    if selected & {"endpointCount", "endpointStatuses"}:
+        counts = {app_id: {} for app_id in app_ids}
+        for app_id, status, count in await db.execute(
+            select(DbEndpoint.applicationId, DbEndpoint.status, func.count()).where(DbEndpoint.applicationId.in_(app_ids)).group_by(DbEndpoint.applicationId, DbEndpoint.status)
+        ):
+            counts[app_id][status or ""] = count
+        for app_id, summary in summaries.items():
+            if "endpointCount" in selected:
+                summary["endpointCount"] = sum(counts[app_id].values())
+            if "endpointStatuses" in selected:
+                summary["endpointStatuses"] = counts[app_id]
 
-# Search for a particular application
-@router.get("/search")
-def search_application(query: str, db: Session = Depends(get_db)):
-    string = f"%{query}%"  
-    apps = db.query(DbApplication).filter(or_(func.lower(DbApplication.baseUrl).like(string.lower()), func.lower(DbApplication.name).like(string.lower()))).all()
-    return apps
+    if "lastProbe" in selected:
+        last_probes = dict((await db.execute(
+            select(DbEndpoint.applicationId, func.max(DbEndpointStats.lastProbe))
+            .join(DbEndpointStats, DbEndpointStats.endpointId == DbEndpoint.uid)
+            .where(DbEndpoint.applicationId.in_(app_ids))
+            .group_by(DbEndpoint.applicationId)
+        )).all())
+        for app_id, summary in summaries.items():
+            summary["lastProbe"] = last_probes.get(app_id)
+
+    return list(summaries.values())
+
+
+def summary_query(selected: set) -> Select:
+    return select(DbApplication.uid, *(column for field, column in SUMMARY_COLUMNS.items() if field in selected))
+
+
+async def read_bulk_items(request: Request) -> list:
+    """Items of a bulk import: a JSON list, or one JSON object per line for NDJSON.
+
+    A line that is not valid JSON becomes an exception in its place.
+    """
+    items = []
+    if request.headers.get("content-type", "").split(";")[0].strip() in NDJSON_TYPES:
+        buffer = b""
+
+        def parse(line: bytes):
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError as e:
+                    items.append(e)
+
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                parse(line)
+            if len(items) > BULK_IMPORT_MAX:
+                break
+        parse(buffer)
+    else:
+        try:
+            items = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body is not valid JSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Expected a list of applications")
+    if len(items) > BULK_IMPORT_MAX:
+        raise HTTPException(status_code=413, detail=f"A bulk import holds at most {BULK_IMPORT_MAX} applications")
+    return items
+
+
+def validation_detail(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors())
+
+
+# Add many applications in one transaction, from a JSON list or an NDJSON
+# body (Content-Type: application/x-ndjson). Invalid items are reported
+# and skipped, the valid ones are all created or none is.
+@router.post("/bulk")
+async def bulk_add_applications(request: Request, db: AsyncSession = Depends(get_async_db), payload = Depends(get_payload)) -> BulkImportResult:
+    errors = []
+    items = []
+    seen = set()
+    for index, raw in enumerate(await read_bulk_items(request)):
+        if isinstance(raw, Exception):
+            errors.append(BulkImportError(index=index, detail=f"Invalid JSON: {raw}"))
+            continue
+        name = raw.get("name") if isinstance(raw, dict) else None
+        try:
+            item = Application.model_validate(raw)
+        except ValidationError as e:
+            errors.append(BulkImportError(index=index, name=name, detail=validation_detail(e)))
+            continue
+        invalid = None
+        for field in ("refreshInterval", "timeToKeep"):
+            try:
+                time_to_seconds(getattr(item, field))
+            except ValueError as e:
+                invalid = f"{field}: {e}"
+                break
+        if invalid:
+            errors.append(BulkImportError(index=index, name=name, detail=invalid))
+            continue
+        if item.name in seen:
+            errors.append(BulkImportError(index=index, name=item.name, detail="Duplicate name in this import"))
+            continue
+        seen.add(item.name)
+        items.append((index, item))
+
+    existing = set((await db.execute(select(DbApplication.name).where(DbApplication.name.in_(seen)))).scalars())
+    for index, item in items:
+        if item.name in existing:
+            errors.append(BulkImportError(index=index, name=item.name, detail="An application with the same name already exists"))
+    items = [item for _, item in items if item.name not in existing]
+    if not items:
+        return BulkImportResult(errors=sorted(errors, key=lambda error: error.index))
+
+    user = (await db.execute(select(DbUser.uid).where(DbUser.keyclockId == payload.get("sub")))).first()
+    addresses = await asyncio.gather(*(get_endpoint_ip(item.baseUrl) for item in items))
+
+    try:
+        app_ids = dict((await db.execute(
+            insert(DbApplication).returning(DbApplication.name, DbApplication.uid),
+            [
+                {
+                    "name": item.name,
+                    "status": "Stable",
+                    "baseUrl": item.baseUrl,
+                    "refreshInterval": item.refreshInterval,
+                    "timeToKeep": item.timeToKeep,
+                    "userId": user.uid if user else None,
+                }
+                for item in items
+            ]
+        )).all())
+        endpoints = [
+            {"relativeUrl": endpoint.relativeUrl, "status": endpoint.status, "applicationId": app_ids[item.name]}
+            for item in items for endpoint in item.endpoints
+        ]
+        if endpoints:
+            await db.execute(insert(DbEndpoint), endpoints)
+        await db.execute(insert(DbIpInfo), [
+            {"address": address, "location": "Romania", "timezone": "Bucharest", "applicationId": app_ids[item.name]}
+            for item, address in zip(items, addresses)
+        ])
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Import conflicted with a concurrent change, no application was created")
+
+    for item in items:
+        scheduler.schedule(app_ids[item.name], time_to_seconds(item.refreshInterval), item.baseUrl)
+
+    return BulkImportResult(
+        created=[
+            ApplicationSummary(
+                uid=app_ids[item.name],
+                name=item.name,
+                status="Stable",
+                baseUrl=item.baseUrl,
+                endpointCount=len(item.endpoints),
+                endpointStatuses=dict(Counter(endpoint.status or "" for endpoint in item.endpoints)),
+            )
+            for item in items
+        ],
+        errors=sorted(errors, key=lambda error: error.index),
+    )
+
+
+# Fetch a page of application summaries ordered by uid, built from column
+# queries only; fields picks a subset of their fields
+@router.get("/all", response_model=ApplicationSummaryPage)
+async def get_all_applications(limit: int = APP_PAGE_SIZE, cursor: Optional[str] = None, fields: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    selected = summary_fields(fields)
+    query = summary_query(selected)
+    if cursor:
+        try:
+            query = query.where(DbApplication.uid > decode_app_cursor(cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    limit = max(1, min(limit, APP_PAGE_MAX))
+    rows = (await db.execute(query.order_by(DbApplication.uid).limit(limit + 1))).all()
+    next_cursor = encode_app_cursor(rows[limit - 1].uid) if len(rows) > limit else None
+    return FastJSONResponse({"applications": await summarize(rows[:limit], selected, db), "nextCursor": next_cursor})
+
+
+# Search applications by name or baseUrl, best matches first
+@router.get("/search", response_model=ApplicationSummaryPage)
+async def search_application(query: str, limit: int = APP_PAGE_SIZE, fields: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    selected = summary_fields(fields)
+    app_ids = await search_applications(query, max(1, min(limit, APP_PAGE_MAX)), db)
+    rows = {row.uid: row for row in await db.execute(summary_query(selected).where(DbApplication.uid.in_(app_ids)))}
+    ranked = [rows[app_id] for app_id in app_ids if app_id in rows]
+    return FastJSONResponse({"applications": await summarize(ranked, selected, db), "nextCursor": None})
 
 
 # Fetch data of a particular application
-@router.get("/{id}")
-def get_application(id: int, db: Session = Depends(get_db)) -> Application:
+@router.get("/{id}", response_model=Application)
+def get_application(id: int, db: Session = Depends(get_db)):
     app = db.query(DbApplication).options(
-        joinedload(DbApplication.endpoints).joinedload(DbEndpoint.log)
+        joinedload(DbApplication.endpoints),
+        selectinload(DbApplication.ipInfo),
+        selectinload(DbApplication.bugs)
     ).filter(DbApplication.uid == id).first()
     
     if app:
-        for endpoint in app.endpoints:
-            endpoint.log.sort(key=lambda x: x.timestamp, reverse=True)
-        return app
+        # Only the latest slice of each log, older entries are paged through /{id}/logs
+        endpoint_ids = [endpoint.uid for endpoint in app.endpoints]
+        logs = group_logs(endpoint_ids, db.scalars(latest_logs_query(endpoint_ids, LOG_SLICE)))
+        return FastJSONResponse(application_document(app, logs))
     raise HTTPException(status_code=400, detail="App with this id does not exist")
 
+
+# Page through the logs of an application, newest first
+@router.get("/{id}/logs", response_model=EndpointLogPage)
+def get_application_logs(id: int, endpointId: Optional[int] = None, since: Optional[datetime] = None, until: Optional[datetime] = None, limit: int = LOG_PAGE_SIZE, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    query = db.query(DbEndpointLog).filter(
+        DbEndpointLog.endpointId.in_(select(DbEndpoint.uid).where(DbEndpoint.applicationId == id))
+    )
+    if endpointId is not None:
+        query = query.filter(DbEndpointLog.endpointId == endpointId)
+    if since:
+        query = query.filter(DbEndpointLog.timestamp >= since)
+    if until:
+        query = query.filter(DbEndpointLog.timestamp < until)
+    if cursor:
+        try:
+            timestamp, uid = decode_log_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(or_(
+            DbEndpointLog.timestamp < timestamp,
+            and_(DbEndpointLog.timestamp == timestamp, DbEndpointLog.uid < uid)
+        ))
+
+    limit = max(1, min(limit, LOG_PAGE_MAX))
+    logs = query.order_by(DbEndpointLog.timestamp.desc(), DbEndpointLog.uid.desc()).limit(limit + 1).all()
+    next_cursor = encode_log_cursor(logs[limit - 1]) if len(logs) > limit else None
+    return FastJSONResponse({"logs": [log_document(log) for log in logs[:limit]], "nextCursor": next_cursor})
+
+# Fields of an exported log row, in CSV column order. Raw probes fill the
+# first five, rollups report their mean as responseTime and the rest
+EXPORT_FIELDS = ("uid", "endpointId", "timestamp", "status", "responseTime", "resolution", "count", "statuses", "minResponseTime", "maxResponseTime")
+# Log tiers in export order, compaction moves each probe to exactly one
+EXPORT_TIERS = (("hour", DbEndpointLogHour), ("minute", DbEndpointLogMinute), ("raw", DbEndpointLog))
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def export_query(model, endpoint_ids, since: Optional[datetime], until: Optional[datetime]) -> Select:
+    if model is DbEndpointLog:
+        time_column = DbEndpointLog.timestamp
+        columns = (DbEndpointLog.uid, DbEndpointLog.endpointId, time_column, DbEndpointLog.status, DbEndpointLog.responseTime)
+    else:
+        time_column = model.bucket
+        columns = (model.uid, model.endpointId, time_column, model.count, model.statuses, model.meanResponseTime, model.minResponseTime, model.maxResponseTime)
+    conditions = [model.endpointId.in_(endpoint_ids)]
+    if since:
+        conditions.append(time_column >= since)
+    if until:
+        conditions.append(time_column < until)
+    return select(*columns).where(*conditions).order_by(time_column, model.uid)
+
+
+def export_record(resolution: str, row) -> tuple:
+    if resolution == "raw":
+        uid, endpoint_id, timestamp, status, response_time = row
+        return (uid, endpoint_id, timestamp, status, response_time, resolution, 1, None, None, None)
+    uid, endpoint_id, bucket, count, statuses, mean, minimum, maximum = row
+    return (uid, endpoint_id, bucket, None, mean, resolution, count, statuses, minimum, maximum)
+
+
+async def export_rows(endpoint_ids, since: Optional[datetime], until: Optional[datetime], format: str):
+    """Stream the matching logs, EXPORT_CHUNK_SIZE rows at a time.
+
+    The part of the range already compacted comes from the hour and minute
+    rollups, then the raw logs follow, each tier oldest first. A rollup is
+    exported when its bucket starts in the range.
+
+    The rows come from a server side cursor in a session of their own, so
+    memory stays flat whatever the size of the export.
+    """
+    if format == "csv":
+        yield ",".join(EXPORT_FIELDS) + "\r\n"
+    async with async_session_scope() as db:
+        for resolution, model in EXPORT_TIERS:
+            result = await db.stream(export_query(model, endpoint_ids, since, until).execution_options(yield_per=EXPORT_CHUNK_SIZE))
+            async for rows in result.partitions():
+                records = [export_record(resolution, row) for row in rows]
+                if format == "csv":
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows((record[0], record[1], record[2].isoformat()) + record[3:] for record in records)
+                    yield buffer.getvalue()
+                else:
+                    yield "".join(
+                        dumps_text({**dict(zip(EXPORT_FIELDS, record)), "statuses": json.loads(record[7]) if record[7] else None}) + "\n"
+                        for record in records
+                    )
+
+
+def export_response(endpoint_ids, format: str, since: Optional[datetime], until: Optional[datetime], filename: str) -> StreamingResponse:
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown format, expected one of {', '.join(EXPORT_MEDIA_TYPES)}")
+    return StreamingResponse(
+        export_rows(endpoint_ids, since, until, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'}
+    )
+
+
+# Export the logs of an application as CSV or NDJSON
+@router.get("/{id}/logs/export")
+async def export_application_logs(id: int, format: str = "csv", endpointId: Optional[int] = None, since: Optional[datetime] = None, until: Optional[datetime] = None, db: AsyncSession = Depends(get_async_db)):
+    if await db.get(DbApplication, id) is None:
+        raise HTTPException(status_code=400, detail="App with this id does not exist")
+    endpoint_ids = select(DbEndpoint.uid).where(DbEndpoint.applicationId == id)
+    if endpointId is not None:
+        endpoint_ids = endpoint_ids.where(DbEndpoint.uid == endpointId)
+    return export_response(endpoint_ids, format, since, until, f"application-{id}-logs")
+
+
+# Export the logs of a particular endpoint as CSV or NDJSON
+@router.get("/export/{endpoint_id}")
+async def export_endpoint_logs(endpoint_id: int, format: str = "csv", since: Optional[datetime] = None, until: Optional[datetime] = None, db: AsyncSession = Depends(get_async_db)):
+    if await db.get(DbEndpoint, endpoint_id) is None:
+        raise HTTPException(status_code=400, detail="Endpoint with this id does not exist")
+    return export_response([endpoint_id], format, since, until, f"endpoint-{endpoint_id}-logs")
+
+
 # Convert to SQLAlchemy format
 def pydantic_to_db_endpoint(endpoint: Endpoint) -> DbEndpoint:
     db_endpoint = DbEndpoint(
@@ -224,26 +567,111 @@ def pydantic_to_db_endpoint(endpoint: Endpoint) -> DbEndpoint:
 def edit_application(id: int, item: Application, db: Session = Depends(get_db)) -> Application:
     app = db.query(DbApplication).options(joinedload(DbApplication.endpoints)).filter(DbApplication.uid == id).first()
     if app:
+        try:
+            interval = time_to_seconds(item.refreshInterval)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"refreshInterval: {e}")
         app.name = item.name
         app.endpoints = [pydantic_to_db_endpoint(endpoint) for endpoint in item.endpoints]
         app.baseUrl = item.baseUrl
         app.refreshInterval = item.refreshInterval
         app.timeToKeep = item.timeToKeep
         db.commit()
+        scheduler.schedule(app.uid, interval, app.baseUrl)
         return app
     else:
         raise HTTPException(status_code=400, detail="App with this id does not exist")
 
 
+# Apply partial changes to an application. Endpoints are added, updated or
+# removed by uid and their logs are left alone.
+@router.patch("/{id}", response_model=ApplicationSummary)
+async def patch_application(id: int, item: ApplicationPatch, db: AsyncSession = Depends(get_async_db)):
+    app = await db.get(DbApplication, id)
+    if app is None:
+        raise HTTPException(status_code=400, detail="App with this id does not exist")
+
+    changes = item.model_dump(include={"name", "baseUrl", "refreshInterval", "timeToKeep"}, exclude_unset=True)
+    if None in changes.values():
+        raise HTTPException(status_code=400, detail="Application fields cannot be null")
+    if "name" in changes and changes["name"] != app.name:
+        if (await db.execute(select(DbApplication.uid).where(DbApplication.name == changes["name"]))).first():
+            raise HTTPException(status_code=400, detail="An application with the same name already exists")
+    if "refreshInterval" in changes:
+        try:
+            interval = time_to_seconds(changes["refreshInterval"])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"refreshInterval: {e}")
+    if "timeToKeep" in changes:
+        try:
+            time_to_seconds(changes["timeToKeep"])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"timeToKeep: {e}")
+
+    if any(None in endpoint.model_dump(exclude_unset=True).values() for endpoint in item.updateEndpoints):
+        raise HTTPException(status_code=400, detail="Endpoint fields cannot be null")
+
+    endpoint_ids = set((await db.execute(select(DbEndpoint.uid).where(DbEndpoint.applicationId == id))).scalars())
+    unknown = ({endpoint.uid for endpoint in item.updateEndpoints} | set(item.removeEndpoints)) - endpoint_ids
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Endpoints {sorted(unknown)} do not belong to this app")
+
+    base_url_changed = "baseUrl" in changes and changes["baseUrl"] != app.baseUrl
+    for field, value in changes.items():
+        setattr(app, field, value)
+    if base_url_changed:
+        await db.execute(update(DbIpInfo).where(DbIpInfo.applicationId == id).values(address=await get_endpoint_ip(app.baseUrl)))
+
+    for endpoint in item.updateEndpoints:
+        values = endpoint.model_dump(exclude={"uid"}, exclude_unset=True)
+        if values:
+            await db.execute(update(DbEndpoint).where(DbEndpoint.uid == endpoint.uid).values(**values))
+    if item.removeEndpoints:
+        await db.execute(delete(DbEndpoint).where(DbEndpoint.uid.in_(item.removeEndpoints)))
+    if item.addEndpoints:
+        await db.execute(insert(DbEndpoint), [
+            {"relativeUrl": endpoint.relativeUrl, "status": endpoint.status, "applicationId": id}
+            for endpoint in item.addEndpoints
+        ])
+    await db.commit()
+
+    if "refreshInterval" in changes:
+        scheduler.schedule(id, interval, app.baseUrl)
+    elif base_url_changed:
+        # Move the app to the phase of its new target
+        try:
+            scheduler.schedule(id, time_to_seconds(app.refreshInterval), app.baseUrl)
+        except ValueError as e:
+            print(f"Cannot schedule app {id}: {e}")
+
+    rows = (await db.execute(summary_query(SUMMARY_FIELDS).where(DbApplication.uid == id))).all()
+    return FastJSONResponse((await summarize(rows, SUMMARY_FIELDS, db))[0])
+
+
 # Delete application
 @router.delete("/{id}")
-def delete_application(id: int, db: Session = Depends(get_db)):
+async def delete_application(id: int, db: AsyncSession = Depends(get_async_db)):
     print(f"{id}")
-    db.query(DbApplication).filter(DbApplication.uid == id).delete()
-    db.commit()
+    await db.execute(delete(DbApplication).where(DbApplication.uid == id))
+    await db.commit()
+    scheduler.cancel(id)
     return {"message": "deleted"}
 
 
+# Downsampled log history of a particular endpoint
+@router.get("/history/{endpoint_id}")
+def get_endpoint_history(endpoint_id: int, resolution: str = "minute", since: Optional[datetime] = None, until: Optional[datetime] = None, db: Session = Depends(get_db)) -> List[EndpointRollup]:
+    model = ROLLUP_MODELS.get(resolution)
+    if model is None:
+        raise HTTPException(status_code=400, detail="Resolution must be one of: " + ", ".join(ROLLUP_MODELS))
+    query = db.query(model).filter(model.endpointId == endpoint_id)
+    if since:
+        query = query.filter(model.bucket >= since)
+    if until:
+        query = query.filter(model.bucket < until)
+    return query.order_by(model.bucket).all()
+
+
 # Get the status ratio of a particular endpoint
 @router.get("/ratio/{id}")
 def get_ratio(id: int, db: Session = Depends(get_db)):
@@ -0,0 +1,165 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from collections import deque
+from datetime import datetime
+import asyncio
+import cProfile
+import io
+import pstats
+import time
+from internal.metrics import registry, current_scope, http_request_duration
+from internal.admin import PROFILE_REQUESTS, PROFILE_KEEP, PROFILE_TOP
+from database.database import TimedQueuePool, TimedAsyncQueuePool, session_stats
+from background.scheduler import scheduler
+from background.probe import probe_engine
+from background.writer import probe_writer
+from background.hub import hub
+from background.resolver import resolver
+from background.shards import shard_manager, update_relay
+from auth.auth import signing_keys, verified_tokens
+
+router = APIRouter(
+    tags=["Metrics"]
+)
+
+# Prometheus text exposition format
+METRICS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# Components that keep their own counters are read at scrape time
+registry.gauge("itec_scheduler_apps", "Applications in the scheduler", callback=lambda: scheduler.stats()["scheduled"])
+registry.gauge("itec_scheduler_in_flight", "Probe cycles running", callback=lambda: scheduler.stats()["inFlight"])
+registry.gauge("itec_scheduler_cadence_apps", "Applications probed faster or slower than their interval", ("cadence",), callback=lambda: [
+    (("fast",), scheduler.stats()["fast"]),
+    (("backed_off",), scheduler.stats()["backedOff"]),
+])
+registry.counter("itec_scheduler_skipped_total", "Probe cycles skipped because the previous one was still running", callback=lambda: scheduler.skipped)
+registry.counter("itec_probes_total", "Probes by whether they sent a request or shared one for the same URL", ("result",), callback=lambda: [
+    (("requested",), probe_engine.requests),
+    (("shared",), probe_engine.shared),
+])
+registry.gauge("itec_writer_queue_depth", "Probe cycles waiting in the probe writer", callback=lambda: probe_writer.queue.qsize())
+registry.gauge("itec_writer_queue_capacity", "Capacity of the probe writer queue", callback=lambda: probe_writer.max_queue)
+registry.counter("itec_writer_blocked_submits_total", "Submits that waited on a full writer queue", callback=lambda: probe_writer.blocked)
+registry.counter("itec_writer_rows_total", "Log rows handled by the probe writer", ("result",), callback=lambda: [
+    (("written",), probe_writer.rows_written),
+    (("failed",), probe_writer.rows_failed),
+])
+registry.gauge("itec_shards_owned", "Shards leased by this worker", callback=lambda: len(shard_manager.owned))
+registry.gauge("itec_shard_workers", "Live workers sharing the shards", callback=lambda: shard_manager.workers)
+registry.counter("itec_ws_relayed_total", "Updates of apps owned by other workers relayed to local clients", callback=lambda: update_relay.relayed)
+registry.gauge("itec_ws_subscribers", "WebSocket clients subscribed to the hub", callback=lambda: hub.stats()["subscribers"])
+registry.counter("itec_ws_messages_total", "Messages handled by the WebSocket hub", ("result",), callback=lambda: [
+    (("published",), hub.published),
+    (("delivered",), hub.delivered),
+    (("dropped",), hub.dropped),
+])
+registry.counter("itec_auth_cache_total", "Lookups in the auth caches", ("cache", "result"), callback=lambda: [
+    (("signing_keys", "hit"), signing_keys.hits),
+    (("signing_keys", "miss"), signing_keys.misses),
+    (("verified_tokens", "hit"), verified_tokens.hits),
+    (("verified_tokens", "miss"), verified_tokens.misses),
+])
+registry.counter("itec_dns_lookups_total", "Lookups in the DNS cache", ("result",), callback=lambda: [
+    (("hit",), resolver.hits),
+    (("miss",), resolver.misses),
+    (("failure",), resolver.failures),
+])
+registry.counter("itec_db_pool_checkouts_total", "Connections checked out of the pools", ("pool",), callback=lambda: [
+    (("sync",), TimedQueuePool.checkout_stats.checkouts),
+    (("async",), TimedAsyncQueuePool.checkout_stats.checkouts),
+])
+registry.counter("itec_db_pool_wait_seconds_total", "Time spent waiting for a free connection", ("pool",), callback=lambda: [
+    (("sync",), TimedQueuePool.checkout_stats.total_wait),
+    (("async",), TimedAsyncQueuePool.checkout_stats.total_wait),
+])
+registry.gauge("itec_db_sessions_open", "Database sessions currently open", callback=lambda: session_stats.open)
+
+
+class MetricsMiddleware:
+    """Times every HTTP request by method, route template and status.
+
+    The ASGI scope is published in current_scope for the query hooks of
+    database/database.py, the router adds the matched route to it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        token = current_scope.set(scope)
+        if scope["type"] == "websocket":
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                current_scope.reset(token)
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            http_request_duration.observe(time.perf_counter() - start, scope["method"], route, str(status))
+            current_scope.reset(token)
+
+
+class ProfilingMiddleware:
+    """Runs requests sent with an X-Profile header under cProfile.
+
+    Only installed when PROFILE_REQUESTS is set. The profiler sees every
+    task on the event loop, so profiled requests are serialized and should
+    be sent to an otherwise quiet process.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = asyncio.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not any(name == b"x-profile" for name, _ in scope["headers"]):
+            return await self.app(scope, receive, send)
+        async with self.lock:
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                profiler.disable()
+                elapsed = time.perf_counter() - start
+                output = io.StringIO()
+                pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_TOP)
+                profiles.append({
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "seconds": elapsed,
+                    "at": datetime.utcnow().isoformat(),
+                    "stats": output.getvalue(),
+                })
+
+
+profiles = deque(maxlen=PROFILE_KEEP)
+
+
+# Prometheus scrape target
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(registry.render(), media_type=METRICS_MEDIA_TYPE)
+
+
+# Latest request profiles, newest first
+@router.get("/metrics/profiles")
+def get_profiles():
+    if not PROFILE_REQUESTS:
+        raise HTTPException(status_code=404, detail="Request profiling is disabled")
+    return list(reversed(profiles))
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Json
+from typing import Dict, List, Optional
 from datetime import datetime
 
 class Bug(BaseModel):
@@ -21,6 +21,49 @@ class EndpointLog(BaseModel):
     class Config:
         from_attributes = True
 
+
+class EndpointLogPage(BaseModel):
+    logs: List[EndpointLog] = []
+    nextCursor: Optional[str] = None
+
+
+class HistogramBin(BaseModel):
+    le: Optional[float] = None
+    count: int
+
+
+class LatencyBucket(BaseModel):
+    start: datetime
+    count: int
+    errorRate: float
+    percentiles: Dict[str, Optional[float]]
+    estimated: bool = False
+
+
+class LatencyReport(BaseModel):
+    since: datetime
+    until: datetime
+    bucket: int
+    count: int
+    errorRate: float
+    percentiles: Dict[str, Optional[float]]
+    estimated: bool = False
+    histogram: List[HistogramBin] = []
+    buckets: List[LatencyBucket] = []
+
+
+class EndpointRollup(BaseModel):
+    endpointId: int
+    bucket: datetime
+    count: int
+    statuses: Json[Dict[str, int]]
+    minResponseTime: Optional[float] = None
+    maxResponseTime: Optional[float] = None
+    meanResponseTime: Optional[float] = None
+    
+    class Config:
+        from_attributes = True
+
     
 class Endpoint(BaseModel):
     uid: int = None
@@ -58,6 +101,48 @@ class Application(BaseModel):
     class Config:
         from_attributes = True
 
+class ApplicationSummary(BaseModel):
+    uid: int
+    name: Optional[str] = None
+    status: Optional[str] = None
+    baseUrl: Optional[str] = None
+    endpointCount: Optional[int] = None
+    endpointStatuses: Optional[Dict[str, int]] = None
+    lastProbe: Optional[datetime] = None
+
+
+class ApplicationSummaryPage(BaseModel):
+    applications: List[ApplicationSummary] = []
+    nextCursor: Optional[str] = None
+
+
+class EndpointPatch(BaseModel):
+    uid: int
+    relativeUrl: Optional[str] = None
+    status: Optional[str] = None
+
+
+class ApplicationPatch(BaseModel):
+    name: Optional[str] = None
+    baseUrl: Optional[str] = None
+    refreshInterval: Optional[str] = None
+    timeToKeep: Optional[str] = None
+    addEndpoints: List[Endpoint] = []
+    updateEndpoints: List[EndpointPatch] = []
+    removeEndpoints: List[int] = []
+
+
+class BulkImportError(BaseModel):
+    index: int
+    name: Optional[str] = None
+    detail: str
+
+
+class BulkImportResult(BaseModel):
+    created: List[ApplicationSummary] = []
+    errors: List[BulkImportError] = []
+
+
 class UserProfile(BaseModel):
     uid: int = None
     username: str = None
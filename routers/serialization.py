@@ -0,0 +1,101 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+import json
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, separators=(",", ":")).encode()
+
+
+def dumps_text(payload) -> str:
+    return dumps(payload).decode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when it is installed.
+
+    Routes that build their documents with the functions below return this
+    directly, which skips FastAPI's validation against the response model.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+# Documents of ORM objects or column rows, in the shape of the matching
+# schemas of routers/schemas.py. Timestamps are ISO strings so the same
+# documents can be sent as msgpack.
+
+def isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def log_document(log) -> dict:
+    return {
+        "uid": log.uid,
+        "responseTime": log.responseTime,
+        "status": log.status,
+        "endpointId": log.endpointId,
+        "timestamp": isoformat(log.timestamp),
+    }
+
+
+def endpoint_document(endpoint, logs: Iterable) -> dict:
+    return {
+        "uid": endpoint.uid,
+        "relativeUrl": endpoint.relativeUrl,
+        "status": endpoint.status,
+        "applicationId": endpoint.applicationId,
+        "log": [log_document(log) for log in logs],
+    }
+
+
+def ip_info_document(ip_info) -> Optional[dict]:
+    if ip_info is None:
+        return None
+    return {
+        "uid": ip_info.uid,
+        "address": ip_info.address,
+        "location": ip_info.location,
+        "timezone": ip_info.timezone,
+        "applicationId": ip_info.applicationId,
+    }
+
+
+def bug_document(bug) -> dict:
+    return {
+        "uid": bug.uid,
+        "description": bug.description,
+        "timestamp": isoformat(bug.timestamp),
+        "applicationId": bug.applicationId,
+    }
+
+
+def application_document(app, logs: Dict[int, List]) -> dict:
+    """Application document with the given logs of each endpoint."""
+    return {
+        "uid": app.uid,
+        "name": app.name,
+        "status": app.status,
+        "baseUrl": app.baseUrl,
+        "ipInfo": ip_info_document(app.ipInfo),
+        "refreshInterval": app.refreshInterval,
+        "timeToKeep": app.timeToKeep,
+        "userId": app.userId,
+        "bugs": [bug_document(bug) for bug in app.bugs],
+        "endpoints": [endpoint_document(endpoint, logs.get(endpoint.uid, [])) for endpoint in app.endpoints],
+    }
@@ -2,11 +2,11 @@ from fastapi import APIRouter
 from fastapi import Depends
 from auth.auth import get_payload
 from routers.schemas import UserProfile
-from sqlalchemy.orm.session import Session
-from database.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.database import get_async_db
 from database.models import DbUser
-from sqlalchemy.orm import joinedload
-from sqlalchemy.orm import session
+from routers.utils import application_loaders
 
 router = APIRouter(
     prefix = "/user-profile",
@@ -14,17 +14,21 @@ router = APIRouter(
 )
 
 @router.get("/me")
-async def get_profile(db: Session = Depends(get_db), payload = Depends(get_payload)) -> UserProfile:
+async def get_profile(db: AsyncSession = Depends(get_async_db), payload = Depends(get_payload)) -> UserProfile:
     print("here")
     token = payload.get("sub")
-    user = db.query(DbUser).filter(DbUser.keyclockId == token).first()
+    user = (await db.execute(select(DbUser).where(DbUser.keyclockId == token))).scalars().first()
     if(user is None):
         user = DbUser(
             username = payload.get("preferred_username"),
             keyclockId=payload.get("sub")
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
-    user = db.query(DbUser).options(joinedload(DbUser.addedApplications), joinedload(DbUser.developedApplications)).filter(DbUser.keyclockId == token).first()
-    return user
\ No newline at end of file
+        await db.commit()
+    user = (await db.execute(
+        select(DbUser).options(
+            *application_loaders(DbUser.addedApplications),
+            *application_loaders(DbUser.developedApplications)
+        ).where(DbUser.keyclockId == token).execution_options(populate_existing=True)
+    )).scalars().first()
+    return user
@@ -1,83 +1,213 @@
-from database.models import DbEndpoint
+from database.models import DbApplication, DbEndpoint, DbEndpointLog, DbEndpointStats, DbOutage
+from sqlalchemy import func, or_, select, Select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import Union
-from sqlalchemy.orm import joinedload
+from typing import Dict, List, Optional, Tuple, Union
+from sqlalchemy.orm import joinedload, selectinload
 from routers.schemas import Application
+from routers.serialization import endpoint_document
+from internal.admin import DEFAULT_DOWNTIME_WINDOW
+from datetime import datetime, timedelta
+import base64
+import bisect
 
-def get_endpoint_status_ratio(endpoint_uid: int, db: Session) -> Union[dict, float]:
-    endpoint = db.query(DbEndpoint).filter(DbEndpoint.uid == endpoint_uid).first()
-    
-    if endpoint:
-        total_logs = len(endpoint.log)
-        stable_count = unstable_count = downtime_count = 0
-        last_10_statuses = [log.status for log in endpoint.log[-10:]]
-        
-        if all(status in ['200', '307'] for status in last_10_statuses):
-            stable_count = total_logs
-        elif all(status not in ['200', '307'] for status in last_10_statuses):
-            unstable_count = total_logs
-        else:
-            is_downtime = False
-            for log in endpoint.log:
-                if log.status == 'Stable':
-                    stable_count += 1
-                    if is_downtime:
-                        downtime_count += 1
-                        is_downtime = False
-                elif log.status == 'Unstable':
-                    unstable_count += 1
-                    if is_downtime:
-                        downtime_count += 1
-                        is_downtime = False
-                else:
-                    if not is_downtime:
-                        is_downtime = True
-        
-        return {
-            'down': downtime_count / total_logs,
-            'stable': stable_count / total_logs,
-            'unstable': unstable_count / total_logs
-        }
+# Number of latest probes an endpoint's stability is judged on
+STATUS_WINDOW = 10
+OK_STATUSES = ('200', '302')
+# Upper bounds of the latency histogram bins, in seconds, the last bin is
+# unbounded. Rollups keep their counts, so changing them splits history.
+HISTOGRAM_BOUNDS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def latency_bin(response_time: float) -> int:
+    return bisect.bisect_left(HISTOGRAM_BOUNDS, response_time)
+
+
+def stability_of(statuses: List[str]) -> str:
+    if all(status in OK_STATUSES for status in statuses):
+        return "Stable"
+    elif all(status not in OK_STATUSES for status in statuses):
+        return "Down"
     else:
-        return {
-            'error': 'Endpoint not found'
-        }
-        
-def determine_stability(endpointId: int, db: Session):
-    endpoint = db.query(DbEndpoint).options(joinedload(DbEndpoint.log)).filter(DbEndpoint.uid == endpointId).first()
-    if endpoint:
-        log_statuses = [log.status for log in endpoint.log[-10:]] 
-        print(log_statuses)
-        if all(status in ['200', '302'] for status in log_statuses):
-            return "Stable"
-        elif all(status not in ['200', '302'] for status in log_statuses):
-            return "Down"
-        else:
-            return "Unstable"
+        return "Unstable"
+
+
+def determine_app_status(endpoint_statuses: List[str], has_bugs: bool) -> str:
+    if all(status == "Stable" for status in endpoint_statuses):
+        status = "Stable"
+    elif any(status == "Unstable" for status in endpoint_statuses):
+        status = "Unstable"
     else:
-        return "Endpoint not found"
-    
-def calculate_downtime_minutes(app: Application) -> float:
-    total_downtime = 0.0
+        status = "Down"
+    # Known bugs turn an unstable app into a down one
+    if has_bugs and status == "Unstable":
+        status = "Down"
+    return status
+
+
+def init_endpoint_stats(endpoint_uid: int, recent_statuses: List[str], db: Session) -> DbEndpointStats:
+    """Create the rolling state of an endpoint, seeded with its latest statuses (oldest first)."""
+    stats = DbEndpointStats(
+        endpointId=endpoint_uid,
+        recentStatuses=",".join(status for status in recent_statuses[-STATUS_WINDOW:] if status),
+        stableCount=0,
+        unstableCount=0,
+        downCount=0
+    )
+    db.add(stats)
+    return stats
+
+
+def record_endpoint_status(stats: DbEndpointStats, status: str, timestamp: datetime) -> str:
+    """Push a probe status into the rolling state and return the new stability."""
+    recent = stats.recentStatuses.split(",") if stats.recentStatuses else []
+    recent.append(status)
+    recent = recent[-STATUS_WINDOW:]
+    stability = stability_of(recent)
     
-    for endpoint in app.endpoints:
-        for log in endpoint.log:
-            if log.status != '200':
-                downtime_start = log.timestamp
-                downtime_end = downtime_start
-                
-                for subsequent_log in endpoint.log:
-                    if subsequent_log.timestamp > downtime_end:
-                        if subsequent_log.status == '200':
-                            break
-                        else:
-                            downtime_end = subsequent_log.timestamp
-                
-                if downtime_end > downtime_start:
-                    downtime_duration = (downtime_end - downtime_start).total_seconds() / 60.0
-                    total_downtime += downtime_duration
+    stats.recentStatuses = ",".join(recent)
+    stats.lastProbe = timestamp
+    if stability == "Stable":
+        stats.stableCount = (stats.stableCount or 0) + 1
+    elif stability == "Unstable":
+        stats.unstableCount = (stats.unstableCount or 0) + 1
+    else:
+        stats.downCount = (stats.downCount or 0) + 1
+    return stability
+
+
+def get_endpoint_status_ratio(endpoint_uid: int, db: Session) -> Union[dict, float]:
+    stats = db.get(DbEndpointStats, endpoint_uid)
+    if stats is None:
+        if db.get(DbEndpoint, endpoint_uid) is None:
+            return {
+                'error': 'Endpoint not found'
+            }
+        return {'down': 0.0, 'stable': 0.0, 'unstable': 0.0}
     
-    return total_downtime
+    total = stats.stableCount + stats.unstableCount + stats.downCount
+    if total == 0:
+        return {'down': 0.0, 'stable': 0.0, 'unstable': 0.0}
+    return {
+        'down': stats.downCount / total,
+        'stable': stats.stableCount / total,
+        'unstable': stats.unstableCount / total
+    }
+        
+def latest_logs_query(endpoint_ids: List[int], per_endpoint: int) -> Select:
+    """Select the newest logs of each endpoint, newest first, in one query."""
+    ranked = select(
+        DbEndpointLog.uid,
+        func.row_number().over(
+            partition_by=DbEndpointLog.endpointId,
+            order_by=(DbEndpointLog.timestamp.desc(), DbEndpointLog.uid.desc())
+        ).label("rank")
+    ).where(DbEndpointLog.endpointId.in_(endpoint_ids)).subquery()
+    return select(DbEndpointLog).join(ranked, ranked.c.uid == DbEndpointLog.uid).where(ranked.c.rank <= per_endpoint).order_by(DbEndpointLog.timestamp.desc(), DbEndpointLog.uid.desc())
+
+
+def group_logs(endpoint_ids: List[int], logs) -> Dict[int, List[DbEndpointLog]]:
+    grouped = {endpoint_id: [] for endpoint_id in endpoint_ids}
+    for log in logs:
+        grouped[log.endpointId].append(log)
+    return grouped
+
+
+# Opaque keyset cursor on (timestamp, uid) for log pages
+def encode_log_cursor(log: DbEndpointLog) -> str:
+    return base64.urlsafe_b64encode(f"{log.timestamp.isoformat()}|{log.uid}".encode()).decode()
+
+def decode_log_cursor(cursor: str) -> Tuple[datetime, int]:
+    timestamp, uid = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(timestamp), int(uid)
+
+def encode_app_cursor(uid: int) -> str:
+    return base64.urlsafe_b64encode(str(uid).encode()).decode()
+
+def decode_app_cursor(cursor: str) -> int:
+    return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+
+def record_outage(outage: Optional[DbOutage], endpoint_uid: int, status: str, timestamp: datetime, db: Session) -> Optional[DbOutage]:
+    """Open or close the endpoint's outage on a status transition.
+
+    Returns the outage that is open after this probe, if any.
+    """
+    if status in OK_STATUSES:
+        if outage is not None:
+            outage.end = timestamp
+        return None
+    if outage is None:
+        outage = DbOutage(endpointId=endpoint_uid, start=timestamp)
+        db.add(outage)
+    return outage
+
+
+async def calculate_downtime_minutes(endpoint_ids: List[int], db: AsyncSession, since: datetime, until: Optional[datetime] = None) -> float:
+    """Total minutes the endpoints spent in an outage within [since, until)."""
+    until = until or datetime.utcnow()
+    if not endpoint_ids:
+        return 0.0
+    outages = await db.execute(select(DbOutage.start, DbOutage.end).where(
+        DbOutage.endpointId.in_(endpoint_ids),
+        DbOutage.start < until,
+        or_(DbOutage.end.is_(None), DbOutage.end > since)
+    ))
+    total_downtime = 0.0
+    for start, end in outages:
+        total_downtime += (min(end or until, until) - max(start, since)).total_seconds()
+    return total_downtime / 60.0
+
+def application_loaders(relationship=None) -> list:
+    """Loader options that eagerly load everything the Application schema reads.
+
+    Async sessions cannot lazy load, so every query whose result is
+    validated into Application has to use these.
+    """
+    options = [
+        selectinload(DbApplication.ipInfo),
+        selectinload(DbApplication.bugs),
+        selectinload(DbApplication.endpoints).selectinload(DbEndpoint.log)
+    ]
+    if relationship is not None:
+        return [selectinload(relationship).options(*options)]
+    return options
+
+
+async def build_app_snapshot(app_id: int, db: AsyncSession) -> Optional[dict]:
+    """State of an application pushed to WebSocket clients, with the latest log of each endpoint."""
+    app = (await db.execute(select(DbApplication).options(
+        selectinload(DbApplication.ipInfo),
+        selectinload(DbApplication.bugs),
+        selectinload(DbApplication.endpoints)
+    ).where(DbApplication.uid == app_id).execution_options(populate_existing=True))).scalars().first()
+    if app is None:
+        return None
+
+    endpoint_ids = [endpoint.uid for endpoint in app.endpoints]
+    logs = group_logs(endpoint_ids, (await db.execute(latest_logs_query(endpoint_ids, 1))).scalars())
+    try:
+        window = time_to_seconds(app.timeToKeep)
+    except (ValueError, AttributeError):
+        window = DEFAULT_DOWNTIME_WINDOW
+    return {
+        "uid": app.uid,
+        "name": app.name,
+        "status": app.status,
+        "baseUrl": app.baseUrl,
+        "downTime": await calculate_downtime_minutes(endpoint_ids, db, since=datetime.utcnow() - timedelta(seconds=window)),
+        "ipInfo": {
+            "uid": app.ipInfo.uid,
+            "address": app.ipInfo.address,
+            "location": app.ipInfo.location,
+            "timezone": app.ipInfo.timezone,
+            "applicationId": app.ipInfo.applicationId
+        } if app.ipInfo else None,
+        "refreshInterval": f"{app.refreshInterval}",
+        "timeToKeep": f"{app.timeToKeep}",
+        "userId": app.userId,
+        "bugs": [{"bug_id": bug.uid, "description": bug.description, "timestamp": str(bug.timestamp)} for bug in app.bugs],
+        "endpoints": [endpoint_document(endpoint, logs[endpoint.uid]) for endpoint in app.endpoints]
+    }
 
 def time_to_seconds(time_str: str) -> int:
     parts = time_str.split()
@@ -1,11 +1,11 @@
-from fastapi import APIRouter, WebSocket, Depends
-from routers.schemas import Application
-from sqlalchemy.orm import Session
-from database.database import get_db
-from database.models import DbApplication, DbEndpointLog
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from database.database import async_session_scope
+from background.hub import hub, encode, negotiate
+from internal.admin import WS_HEARTBEAT_INTERVAL
+from internal.metrics import ws_connections, ws_send_duration
 import asyncio
-from routers.utils import time_to_seconds, calculate_downtime_minutes
-import json
+import time
+from routers.utils import build_app_snapshot
 
 
 router = APIRouter(
@@ -13,67 +13,74 @@ router = APIRouter(
     tags=["Web Socket"]
 )
 
+HEARTBEAT = {"type": "heartbeat"}
 
-@router.websocket("/{id}")
-async def websocket_endpoint(id: int, websocket: WebSocket, db: Session = Depends(get_db)):
-    await websocket.accept()
+
+async def wait_for_disconnect(websocket: WebSocket):
     while True:
-        try:
-            last_app: Application = db.query(DbApplication).filter(DbApplication.uid == id).order_by(DbApplication.uid.desc()).first()
-            db.refresh(last_app)
-            refreshInterval = last_app.refreshInterval
-            await asyncio.sleep(0.95 * time_to_seconds(refreshInterval))
-        
-            if last_app:
-                app_data = {
-                    "uid": last_app.uid,
-                    "name": last_app.name,
-                    "status": last_app.status,
-                    "baseUrl": last_app.baseUrl,
-                    "downTime": calculate_downtime_minutes(last_app),
-                    "ipInfo": {
-                        "uid": last_app.ipInfo.uid,
-                        "address": last_app.ipInfo.address,
-                        "location": last_app.ipInfo.location,
-                        "timezone": last_app.ipInfo.timezone,
-                        "applicationId": last_app.ipInfo.applicationId
-                    },
-                    "refreshInterval": f"{refreshInterval}",
-                    "timeToKeep": f"{last_app.timeToKeep}",
-                    "userId": last_app.userId,
-                    "bugs": [{"bug_id": bug.uid, "description": bug.description, "timestamp": str(bug.timestamp)} for bug in last_app.bugs],
-                    "endpoints": []
-                }
-            
-                for endpoint in last_app.endpoints:
-                    endpoint_data = {
-                        "uid": endpoint.uid,
-                        "relativeUrl": endpoint.relativeUrl,
-                        "status": "",
-                        "applicationId": endpoint.applicationId,
-                        "log": []
-                    }
-                
-                    latest_log = db.query(DbEndpointLog).filter(DbEndpointLog.endpointId == endpoint.uid).order_by(DbEndpointLog.timestamp.desc()).first()
-                
-                    if latest_log:
-                        log_data = {
-                            "uid": latest_log.uid,
-                            "responseTime": latest_log.responseTime,
-                            "status": latest_log.status,
-                            "endpointId": latest_log.endpointId,
-                            "timestamp": latest_log.timestamp.isoformat()
-                        }
-                        endpoint_data["log"].append(log_data)
-                
-                    app_data["endpoints"].append(endpoint_data)
-            
-                app_json = json.dumps(app_data)
-            
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+async def send(websocket: WebSocket, message):
+    kind, payload = message
+    start = time.perf_counter()
+    if kind == "bytes":
+        await websocket.send_bytes(payload)
+    else:
+        await websocket.send_text(payload)
+    ws_send_duration.observe(time.perf_counter() - start)
+
 
-                await websocket.send_text(app_json)
+@router.websocket("/{id}")
+async def websocket_endpoint(id: int, websocket: WebSocket):
+    """Live state of an application.
+
+    Clients that request the itec.v2.json or itec.v2.msgpack subprotocol get
+    a snapshot tagged with a sequence number on connect, then only deltas.
+    Other clients get the full document on every change, and again after
+    WS_HEARTBEAT_INTERVAL seconds without one. Per-message deflate is
+    negotiated by the server when the client offers it.
+    """
+    subprotocol, version, encoding = negotiate(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=subprotocol)
+    ws_connections.inc(subprotocol or "v1")
+    async with async_session_scope() as db:
+        snapshot = await build_app_snapshot(id, db)
+    if snapshot is None:
+        await websocket.send_text("Application not found")
+        await websocket.close()
+        return
+
+    # Later states are published by the monitor once per probe cycle
+    subscriber = hub.subscribe(id, snapshot, version, encoding)
+    disconnected = asyncio.create_task(wait_for_disconnect(websocket))
+    try:
+        await send(websocket, hub.snapshot_message(id, subscriber))
+        while True:
+            message = asyncio.create_task(subscriber.queue.get())
+            done, _ = await asyncio.wait({message, disconnected}, timeout=WS_HEARTBEAT_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                message.cancel()
+                break
+            if message in done:
+                await send(websocket, message.result())
             else:
-                await websocket.send_text("Application not found")
-                
-        except Exception as e:
-            continue
\ No newline at end of file
+                message.cancel()
+                if version == 1:
+                    # Original clients only understand full documents, resend the current one
+                    await send(websocket, hub.snapshot_message(id, subscriber))
+                else:
+                    await send(websocket, encode(HEARTBEAT, encoding))
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        hub.unsubscribe(id, subscriber)
+        disconnected.cancel()
+
+
+# Subscribers and message counts of the WebSocket hub
+@router.get("/hub/stats")
+def get_hub_stats():
+    return hub.stats()